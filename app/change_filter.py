@@ -0,0 +1,49 @@
+import math
+import time
+from typing import Callable, Optional, Sequence
+
+
+class ChangeFilter:
+    """
+    Decides whether values need to be forwarded again
+
+    Values are forwarded when any of them changed by more than its tolerance since they were last sent,
+    or when the keepalive period expired, so the receiver still gets regular updates of unchanged values.
+    Non-numeric values (e.g. timestamps) are forwarded on any change.
+    """
+
+    def __init__(self, tolerances: Sequence[float], keepalive: float = 1.0, angular: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tolerances = tolerances
+        self.keepalive = keepalive
+        # compare values as angles in degrees, e.g. 359 and 1 differ by 2
+        self.angular = angular
+        self.clock = clock
+        self.last_values: Optional[Sequence] = None
+        self.last_sent = -math.inf
+        # time of the last check, so the keepalive does not include the time it takes to send
+        self.last_checked = -math.inf
+
+    def should_send(self, values: Sequence) -> bool:
+        self.last_checked = self.clock()
+        if self.last_values is None or self.last_checked - self.last_sent >= self.keepalive:
+            return True
+        return any(self._changed(new, old, tolerance)
+                   for new, old, tolerance in zip(values, self.last_values, self.tolerances))
+
+    def sent(self, values: Sequence) -> None:
+        """
+        Records values as successfully forwarded
+        """
+        self.last_values = values
+        self.last_sent = self.last_checked
+
+    def _changed(self, new, old, tolerance: float) -> bool:
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)):
+            return new != old
+        if math.isnan(new) or math.isnan(old):
+            return math.isnan(new) != math.isnan(old)
+        difference = new - old
+        if self.angular:
+            difference = (difference + 180) % 360 - 180
+        return abs(difference) > tolerance
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+
+CLOSED = "closed"        # endpoint healthy, requests pass
+OPEN = "open"            # endpoint considered down, requests fail immediately
+HALF_OPEN = "half_open"  # backoff expired, a single probe request is let through
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of sending a request to an endpoint that is known to be down
+    """
+
+
+class Backoff:
+    """
+    Exponentially growing delay, e.g. between connection attempts
+    """
+
+    def __init__(self, initial: float = 0.5, maximum: float = 8.0, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def next(self) -> float:
+        """
+        Returns the delay to wait now, and increases it for the next time
+        """
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+
+    def reset(self) -> None:
+        self.delay = self.initial
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one endpoint (host)
+
+    After "failure_threshold" consecutive failures the circuit opens and requests are short-circuited,
+    instead of each blocking for a timeout. Once the backoff expired a single probe is let through
+    (half open): success closes the circuit, failure opens it again with a doubled backoff.
+    State changes are logged once, instead of every failed request.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, initial_backoff: float = 0.5,
+                 max_backoff: float = 8.0, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff = Backoff(initial_backoff, max_backoff)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.short_circuited = 0
+
+    def allow(self) -> bool:
+        """
+        Returns if a request may be sent now
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() >= self.open_until:
+                self.state = HALF_OPEN
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state != CLOSED:
+                logger.info(f"{self.name} is reachable again")
+            self.state = CLOSED
+            self.failures = 0
+            self.backoff.reset()
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                delay = self.backoff.next()
+                if self.state == CLOSED:
+                    logger.warning(f"{self.name} failed {self.failures} times, pausing requests to it")
+                self.state = OPEN
+                self.open_until = self.clock() + delay
+                logger.debug("{} still unreachable, next probe in {:.1f} s", self.name, delay)
+
+    def release(self) -> None:
+        """
+        A request that was let through ended without telling anything about the endpoint (e.g. a local error)
+        """
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
@@ -0,0 +1,134 @@
+import math
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flight_recorder import DEPTH, ESTIMATE, KIND_NAMES, LOCATOR, ORIENTATION, TOPSIDE
+
+# names of the values forwarded by each stream, as in the flight recording
+FIELDS = {
+    DEPTH: ("depth", "temperature"),
+    ORIENTATION: ("heading",),
+    LOCATOR: ("lat", "lon", "hdop", "fix_quality"),
+    TOPSIDE: ("lat", "lon", "hdop", "orientation"),
+    ESTIMATE: ("lat", "lon", "horiz_accuracy", "speed"),
+}
+
+
+class DashboardState:
+    """
+    Latest forwarded values, counts and errors of every stream, shown on the status page
+
+    Updated by the forwarding jobs (from any thread) at no cost besides a lock, and read once per broadcast
+    of the status page, so open dashboards never cause requests to the UGPS or mavlink2rest.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        # stream name -> latest values, time of the latest sample, sent and failed samples
+        self.streams: Dict[str, dict] = {}
+        # consumer -> time and counts of its previous snapshot, to report rates since then
+        self.baselines: Dict[str, Tuple[float, Dict[str, int]]] = {}
+
+    def update(self, kind: int, ok: bool, values, latency: float = math.nan,
+               timestamp: Optional[float] = None) -> None:
+        """
+        Stores a forwarded sample, arguments as for FlightRecorder.record()
+        """
+        name = KIND_NAMES.get(kind, str(kind))
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self.lock:
+            stream = self.streams.get(name)
+            if stream is None:
+                stream = self.streams[name] = {"sent": 0, "errors": 0, "values": {}, "time": None,
+                                               "latency": None, "last_error": None}
+            if ok:
+                stream["sent"] += 1
+                # NaN is not valid JSON
+                stream["values"] = {field: value for field, value in zip(FIELDS.get(kind, ()), values)
+                                    if not math.isnan(value)}
+                stream["time"] = timestamp
+                stream["latency"] = None if math.isnan(latency) else latency
+            else:
+                stream["errors"] += 1
+                stream["last_error"] = timestamp
+
+    def snapshot(self, consumer: str = "status") -> dict:
+        """
+        Returns the state of all streams, with the age of their values and their rates since the previous
+        snapshot of the same consumer, e.g. the live page and polls of /status each have their own
+        """
+        now = self.clock()
+        with self.lock:
+            streams = {name: dict(stream) for name, stream in self.streams.items()}
+            previous_time, previous_counts = self.baselines.get(consumer, (None, {}))
+            elapsed = None if previous_time is None else now - previous_time
+            for name, stream in streams.items():
+                stream["rate"] = (stream["sent"] - previous_counts.get(name, 0)) / elapsed if elapsed else None
+                stream["age"] = None if stream["time"] is None else now - stream["time"]
+            self.baselines[consumer] = (now, {name: stream["sent"] for name, stream in streams.items()})
+        return {"time": now, "streams": streams}
+
+
+# status page, rendering the server-sent events of /events
+# URLs are relative, as BlueOS serves extensions below a path of its own
+PAGE = b"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Water Linked UGPS</title>
+<style>
+body { font-family: sans-serif; margin: 1em; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #ccc; padding: 0.2em 0.6em; text-align: left; }
+.error { color: #c00; }
+</style>
+</head>
+<body>
+<h1>Water Linked UGPS</h1>
+<p id="connection">Connecting...</p>
+<table>
+<thead><tr><th>Stream</th><th>Values</th><th>Age (s)</th><th>Rate (Hz)</th><th>Sent</th><th>Errors</th></tr></thead>
+<tbody id="streams"></tbody>
+</table>
+<h2>Hosts</h2>
+<ul id="hosts"></ul>
+<script>
+function number(value, digits) {
+  return value === null || value === undefined ? "-" : value.toFixed(digits);
+}
+function cell(row, text, className) {
+  const td = row.insertCell();
+  td.textContent = text;
+  if (className) td.className = className;
+}
+const events = new EventSource("events");
+events.onopen = () => { document.getElementById("connection").textContent = "Live"; };
+events.onerror = () => { document.getElementById("connection").textContent = "Disconnected, reconnecting..."; };
+events.onmessage = (event) => {
+  const status = JSON.parse(event.data);
+  const body = document.getElementById("streams");
+  body.replaceChildren();
+  for (const [name, stream] of Object.entries(status.streams)) {
+    const row = body.insertRow();
+    cell(row, name);
+    cell(row, Object.entries(stream.values).map(([key, value]) => key + " " + +value.toFixed(7)).join(", "));
+    cell(row, number(stream.age, 1));
+    cell(row, number(stream.rate, 1));
+    cell(row, stream.sent);
+    cell(row, stream.errors, stream.errors ? "error" : "");
+  }
+  const hosts = document.getElementById("hosts");
+  hosts.replaceChildren();
+  for (const [host, state] of Object.entries(status.hosts || {})) {
+    const item = document.createElement("li");
+    item.textContent = host + ": " + state;
+    if (state !== "closed") item.className = "error";
+    hosts.appendChild(item);
+  }
+};
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,190 @@
+"""
+Fixed-size binary recording of everything the extension forwards
+
+Records are stored in a memory-mapped ring buffer file, the oldest records are overwritten once it is full,
+so the file never grows. Recording a sample is a single struct.pack_into into the mapped memory, the kernel
+writes the pages back to disk in the background. The file is reopened after a restart and recording continues
+where it stopped.
+
+Export a recording with: python flight_recorder.py export <recording> <csv file>
+"""
+
+import argparse
+import csv
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, NamedTuple, Sequence
+
+from loguru import logger
+
+MAGIC = b"UGPSREC1"
+# magic, record size, capacity (records), records written in total
+HEADER = struct.Struct("<8sIIQ")
+HEADER_SIZE = 64
+# time (UNIX), kind, send result, padding, send duration (s), latency (s), 4 values depending on kind
+RECORD = struct.Struct("<dBB2xff4d")
+
+# record kinds and the meaning of their values
+DEPTH = 1          # depth (m), temperature (degrees Celsius)
+ORIENTATION = 2    # heading (degrees)
+LOCATOR = 3        # lat, lon, hdop, fix quality, latency is the fix age when sent
+TOPSIDE = 4        # lat, lon, hdop, orientation (degrees)
+ESTIMATE = 5       # lat, lon, horizontal accuracy (m), speed (m/s)
+KIND_NAMES = {DEPTH: "depth", ORIENTATION: "orientation", LOCATOR: "locator", TOPSIDE: "topside",
+              ESTIMATE: "estimate"}
+
+
+class Record(NamedTuple):
+    time: float
+    kind: int
+    ok: bool
+    duration: float
+    latency: float
+    values: tuple
+
+
+class FlightRecorder:
+    """
+    Records forwarded samples into a memory-mapped ring buffer file of "capacity" records
+
+    Thread safe, forwarding jobs record from their own threads.
+
+    Exception handling: Opening failures are reported over logging, the extension then runs without recording.
+    """
+
+    def __init__(self, path: str, capacity: int = 100000):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.mmap = None
+        self.written = 0
+
+    def open(self) -> bool:
+        """
+        Maps the recording file, creating it if it does not exist or has a different layout
+        Returns if recording is possible
+        """
+        size = HEADER_SIZE + self.capacity * RECORD.size
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self.mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            logger.error(f"Could not open flight recorder {self.path}: {e}")
+            self.mmap = None
+            return False
+        magic, record_size, capacity, written = HEADER.unpack_from(self.mmap, 0)
+        if (magic, record_size, capacity) == (MAGIC, RECORD.size, self.capacity):
+            self.written = written
+        else:
+            logger.info(f"Starting new flight recording in {self.path}")
+            self.written = 0
+            self.mmap[:] = bytes(size)
+        self._write_header()
+        logger.info(f"Flight recorder {self.path}: {min(self.written, self.capacity)} of {self.capacity} records used")
+        return True
+
+    def record(self, kind: int, ok: bool, values: Sequence[float], duration: float = math.nan,
+               latency: float = math.nan, timestamp: float = None) -> None:
+        """
+        Appends a sample, up to 4 values whose meaning depends on "kind"
+        """
+        if self.mmap is None:
+            return
+        values = tuple(values) + (math.nan,) * (4 - len(values))
+        with self.lock:
+            offset = HEADER_SIZE + (self.written % self.capacity) * RECORD.size
+            RECORD.pack_into(self.mmap, offset, timestamp or time.time(), kind, ok, duration, latency, *values)
+            self.written += 1
+            self._write_header()
+
+    def flush(self) -> None:
+        """
+        Writes the recording to disk now, otherwise the kernel does so in the background
+        """
+        if self.mmap is not None:
+            self.mmap.flush()
+
+    def close(self) -> None:
+        if self.mmap is not None:
+            self.mmap.flush()
+            self.mmap.close()
+            self.mmap = None
+
+    def _write_header(self) -> None:
+        HEADER.pack_into(self.mmap, 0, MAGIC, RECORD.size, self.capacity, self.written)
+
+
+def read_header(data) -> tuple:
+    """
+    Returns (capacity, records written) of a recording, raises ValueError if it is none
+    """
+    magic, record_size, capacity, written = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError("Not a flight recording")
+    return capacity, written
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """
+    Yields the records of a recording, oldest first
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    capacity, written = read_header(data)
+    for index in range(max(written - capacity, 0), written):
+        time_, kind, ok, duration, latency, *values = RECORD.unpack_from(
+            data, HEADER_SIZE + (index % capacity) * RECORD.size)
+        yield Record(time_, kind, bool(ok), duration, latency, tuple(values))
+
+
+def export_csv(path: str, output: str) -> int:
+    """
+    Writes a recording as CSV, returns the number of records
+    """
+    count = 0
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["time", "kind", "ok", "duration", "latency", "value1", "value2", "value3", "value4"])
+        for record in read_records(path):
+            writer.writerow([record.time, KIND_NAMES.get(record.kind, record.kind), int(record.ok),
+                             record.duration, record.latency, *record.values])
+            count += 1
+    return count
+
+
+def to_numpy(path: str):
+    """
+    Returns a recording as a NumPy structured array, oldest first
+    NumPy is only needed for this export, it is not a dependency of the extension.
+    """
+    import numpy as np
+
+    dtype = np.dtype([("time", "<f8"), ("kind", "u1"), ("ok", "?"), ("padding", "V2"), ("duration", "<f4"),
+                      ("latency", "<f4"), ("values", "<f8", (4,))])
+    with open(path, "rb") as file:
+        data = file.read()
+    capacity, written = read_header(data)
+    records = np.frombuffer(data, dtype=dtype, count=capacity, offset=HEADER_SIZE)
+    if written <= capacity:
+        return records[:written].copy()
+    return np.roll(records, -(written % capacity))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports a flight recording of the UGPS extension.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Export a recording as CSV.")
+    export.add_argument("recording", help="Recording file, e.g. /root/.config/ugps_extension/flight_recording.bin")
+    export.add_argument("output", help="CSV file to write.")
+    args = parser.parse_args()
+    print(f"Exported {export_csv(args.recording, args.output)} records to {args.output}")
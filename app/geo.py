@@ -0,0 +1,47 @@
+import math
+from typing import Tuple
+
+# WGS84 ellipsoid
+EQUATORIAL_RADIUS = 6378137.0
+ECCENTRICITY_SQUARED = 6.69437999014e-3
+
+
+class LocalTangentPlane:
+    """
+    Converts between latitude/longitude and north/east meters relative to a reference point
+
+    The meters per degree at the reference are computed once, so conversions are a multiply and an add.
+    Accurate to centimeters within a few kilometers of the reference, plenty for an acoustic positioning range.
+    """
+
+    def __init__(self, lat: float, lon: float):
+        self.lat = lat
+        self.lon = lon
+        sin_lat = math.sin(math.radians(lat))
+        denominator = 1 - ECCENTRICITY_SQUARED * sin_lat * sin_lat
+        # radii of curvature in the meridian and the prime vertical
+        meridian = EQUATORIAL_RADIUS * (1 - ECCENTRICITY_SQUARED) / denominator ** 1.5
+        prime_vertical = EQUATORIAL_RADIUS / math.sqrt(denominator)
+        self.meters_per_degree_lat = math.radians(meridian)
+        self.meters_per_degree_lon = math.radians(prime_vertical * math.cos(math.radians(lat)))
+
+    def to_local(self, lat: float, lon: float) -> Tuple[float, float]:
+        """
+        Returns (north, east) in meters from the reference
+        """
+        return ((lat - self.lat) * self.meters_per_degree_lat,
+                (lon - self.lon) * self.meters_per_degree_lon)
+
+    def to_global(self, north: float, east: float) -> Tuple[float, float]:
+        """
+        Returns (lat, lon) of a point "north" and "east" meters from the reference
+        """
+        return (self.lat + north / self.meters_per_degree_lat,
+                self.lon + east / self.meters_per_degree_lon)
+
+
+def offset_position(lat: float, lon: float, north: float, east: float) -> Tuple[float, float]:
+    """
+    Returns (lat, lon) of the point "north" and "east" meters away from lat, lon
+    """
+    return LocalTangentPlane(lat, lon).to_global(north, east)
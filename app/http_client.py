@@ -0,0 +1,222 @@
+import http.client
+import socket
+import threading
+import time
+from json import dumps, loads
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import HTTP_ERRORS, HTTP_REQUEST_SECONDS
+
+# Either a single timeout in seconds, or a (connect, read) tuple
+Timeout = Union[float, Tuple[float, float]]
+# libraries requests can be sent with, "stdlib" needs no third party packages
+BACKENDS = ("requests", "stdlib")
+
+
+class HttpResponse:
+    """
+    Response of the stdlib backend, with the parts of requests.Response the API clients use
+    """
+
+    def __init__(self, status_code: int, reason: str, content: bytes):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return loads(self.content)
+
+
+class StdlibTransport:
+    """
+    Sends the requests of HttpClient with http.client, over pooled keep-alive connections
+
+    Importing it costs a fraction of the memory and startup time of requests and urllib3.
+    A request failing on a connection error is retried on a new connection, as a reused keep-alive
+    connection may have been closed by the server meanwhile. Timeouts are not retried.
+
+    Exception handling: Exceptions are passed on to the caller, which is responsible for reporting them.
+    """
+
+    # socket.timeout is an OSError as well, so timeouts have to be checked first
+    timeout_errors = (socket.timeout,)
+    connection_errors = (OSError, http.client.HTTPException)
+
+    def __init__(self, pool_maxsize: int = 4, retries: int = 1):
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.lock = threading.Lock()
+        # "scheme://host:port" -> idle connections, and counts of opened and reused ones
+        self.pools: Dict[str, List[http.client.HTTPConnection]] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def send(self, method: str, url: str, timeout: Timeout, json=None) -> HttpResponse:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        host = f"{parts.scheme}://{parts.hostname}:{port}"
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        headers = {}
+        body = None
+        if json is not None:
+            body = dumps(json).encode()
+            headers["Content-Type"] = "application/json"
+
+        retries = self.retries
+        while True:
+            connection = self._acquire(host, parts.scheme, parts.hostname, port, connect_timeout)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(read_timeout)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                content = response.read()
+            except self.timeout_errors:
+                connection.close()
+                raise
+            except self.connection_errors:
+                connection.close()
+                if retries <= 0:
+                    raise
+                retries -= 1
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(host, connection)
+            return HttpResponse(response.status, response.reason, content)
+
+    def _acquire(self, host: str, scheme: str, hostname: str, port: int,
+                 connect_timeout: float) -> http.client.HTTPConnection:
+        with self.lock:
+            stats = self.stats.setdefault(host, {"opened": 0, "reused": 0})
+            idle = self.pools.get(host)
+            if idle:
+                stats["reused"] += 1
+                return idle.pop()
+            stats["opened"] += 1
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(hostname, port, timeout=connect_timeout)
+
+    def _release(self, host: str, connection: http.client.HTTPConnection) -> None:
+        with self.lock:
+            idle = self.pools.setdefault(host, [])
+            if len(idle) < self.pool_maxsize:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def connection_stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {host: dict(stats) for host, stats in self.stats.items()}
+
+    def close(self) -> None:
+        with self.lock:
+            for idle in self.pools.values():
+                for connection in idle:
+                    connection.close()
+            self.pools.clear()
+
+
+class HttpClient:
+    """
+    Shared pool of persistent (keep-alive) HTTP connections
+
+    A single instance is meant to be shared by all API clients (mavlink2rest, UGPS), so that
+    every forwarding cycle reuses already established TCP/TLS connections instead of opening
+    new ones. Sockets dropped by the remote end (e.g. idle keep-alive connections closed by a
+    restarted server) are transparently re-opened and the request is retried once.
+    Every host has a circuit breaker, requests to a host that is known to be down fail
+    immediately with CircuitOpenError instead of blocking for the timeout.
+
+    Requests are sent with requests (urllib3) by default, or with the standard library ("stdlib" backend),
+    which is imported faster and takes less memory.
+
+    Exception handling: Exceptions are passed on to the caller, which is responsible for reporting them.
+    """
+
+    def __init__(self, timeout: Timeout = (1.0, 1.0), pool_connections: int = 4, pool_maxsize: int = 4,
+                 retries: int = 1, failure_threshold: int = 3, max_backoff: float = 8.0, backend: str = "requests"):
+        # default timeout for all requests, can be overridden per request
+        self.timeout = timeout
+        # host -> health of the host
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.failure_threshold = failure_threshold
+        self.max_backoff = max_backoff
+        if backend == "stdlib":
+            self.transport = StdlibTransport(pool_maxsize, retries)
+        else:
+            # imported on demand, so the stdlib backend never loads requests and urllib3
+            from requests_transport import RequestsTransport
+            self.transport = RequestsTransport(pool_connections, pool_maxsize, retries)
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs):
+        """
+        Sends a request over a pooled connection, its duration and errors are recorded as metrics
+        Returns the response object, raises on connection errors and timeouts,
+        and CircuitOpenError if the host is known to be down
+        """
+        parts = urlsplit(url)
+        labels = {"host": parts.netloc, "method": method, "path": parts.path}
+        breaker = self.breaker(parts.netloc)
+        if not breaker.allow():
+            HTTP_ERRORS.inc(kind="circuit_open", **labels)
+            raise CircuitOpenError(f"{parts.netloc} is unreachable, request skipped")
+        start = time.monotonic()
+        try:
+            response = self.transport.send(method, url, timeout or self.timeout, **kwargs)
+        except self.transport.timeout_errors:
+            HTTP_ERRORS.inc(kind="timeout", **labels)
+            breaker.record_failure()
+            raise
+        except self.transport.connection_errors:
+            HTTP_ERRORS.inc(kind="connection", **labels)
+            breaker.record_failure()
+            raise
+        except Exception:
+            HTTP_ERRORS.inc(kind="other", **labels)
+            breaker.release()
+            raise
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.monotonic() - start, **labels)
+        if response.status_code != 200:
+            HTTP_ERRORS.inc(kind="http", **labels)
+        # an overloaded or restarting server counts as down, other errors still mean it is reachable
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers.setdefault(host, CircuitBreaker(host, self.failure_threshold,
+                                                                    max_backoff=self.max_backoff))
+        return breaker
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def connection_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Counts connections opened vs. reused, per host
+        Returns {"scheme://host:port": {"opened": n, "reused": m}}
+        """
+        return self.transport.connection_stats()
+
+    def close(self) -> None:
+        self.transport.close()
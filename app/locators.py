@@ -0,0 +1,145 @@
+import argparse
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+from change_filter import ChangeFilter
+from geo import LocalTangentPlane
+from mavlink2resthelper import Mavlink2RestHelper
+from position_filter import PositionFilter
+
+DEFAULT_LOCATOR_PATH = "/api/v1/position/global"
+DEFAULT_RELATIVE_PATH = "/api/v1/position/acoustic/filtered"
+MAPPING_KEYS = ("name", "path", "relative_path", "mavlink", "vehicle", "gps_id", "udp")
+
+
+class Locator:
+    """
+    A locator of the UGPS, polled once per tick no matter to how many vehicles its fixes are sent
+    """
+
+    def __init__(self, path: str, position_filter: Optional[PositionFilter] = None,
+                 relative_path: str = DEFAULT_RELATIVE_PATH):
+        # UGPS API paths of the locator position, global and relative to the topside
+        self.path = path
+        self.relative_path = relative_path
+        # latest successfully polled position, and the fix it contains (position, quality and timestamp)
+        self.position: Optional[dict] = None
+        self.fix: Optional[tuple] = None
+        # if the latest poll returned a fix not seen before
+        self.new_fix = False
+        # successful polls, so targets can tell new poll results from ones they already handled
+        self.polls = 0
+        # optional estimator between fixes, shared by all targets, only updated with new fixes
+        self.position_filter = position_filter
+        self.last_fix: Optional[dict] = None
+
+    def update(self, position: dict) -> None:
+        """
+        Stores a polled position
+        A fix polled again keeps the "fix_time" of its first poll, as the UGPS only provides
+        a timestamp on some paths, so repeats are not stamped as fresh measurements.
+        """
+        # a new acoustic fix changes position, quality or (if provided) timestamp
+        fix = (position['lat'], position['lon'], position.get('fix_quality'), position.get('timestamp'))
+        self.new_fix = fix != self.fix
+        if not self.new_fix and 'fix_time' in self.position:
+            position['fix_time'] = self.position['fix_time']
+        self.position = position
+        self.fix = fix
+        self.polls += 1
+
+
+class LocatorTarget:
+    """
+    A vehicle the fixes of a locator are sent to as GPS_INPUT, through the mavlink2rest of the vehicle
+    """
+
+    def __init__(self, name: str, locator: Locator, mavlink: Mavlink2RestHelper, gps_id: int = 0,
+                 keepalive: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.locator = locator
+        self.mavlink = mavlink
+        # GPS instance of the autopilot
+        self.gps_id = gps_id
+        # unchanged fixes are sent again after the keepalive
+        self.filter = ChangeFilter((0, 0, 0, 0), keepalive, clock=clock)
+        # polls of the locator already handled
+        self.handled_polls = 0
+
+
+class TopsideReference:
+    """
+    Latest global position and heading of the UGPS topside, to convert acoustic positions relative to it
+
+    The local tangent plane and the rotation by the heading are computed once per topside position,
+    so converting a batch of relative positions takes a few multiplications each.
+    Relative positions are in meters, "x" forward along the heading of the topside, "y" to starboard.
+    """
+
+    def __init__(self, max_age: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        # latest topside position, and (plane, cos(heading), sin(heading)) replaced as one
+        self.position: Optional[dict] = None
+        self.frame = None
+        self.updated = -math.inf
+
+    def update(self, position: dict) -> None:
+        """
+        Stores a topside position as polled from the UGPS, ignored without a valid heading
+        """
+        if position.get('fix_quality') == 0 or not 0 <= position['orientation'] <= 360:
+            return
+        heading = math.radians(position['orientation'])
+        self.frame = (LocalTangentPlane(position['lat'], position['lon']), math.cos(heading), math.sin(heading))
+        self.position = position
+        self.updated = self.clock()
+
+    def valid(self) -> bool:
+        """
+        If a topside position is known and recent enough to convert relative positions
+        """
+        return self.clock() - self.updated <= self.max_age
+
+    def to_global(self, relative_positions: List[dict]) -> List[dict]:
+        """
+        Converts relative positions of the UGPS to global positions as served on /api/v1/position/global
+        The global accuracy is the one of the topside GPS, the standard deviation of the acoustic
+        position is passed on as horizontal accuracy.
+        """
+        plane, cos, sin = self.frame
+        topside = self.position
+        positions = []
+        for relative in relative_positions:
+            x, y = relative['x'], relative['y']
+            lat, lon = plane.to_global(x * cos - y * sin, x * sin + y * cos)
+            position = {"lat": lat, "lon": lon, "orientation": -1, "hdop": topside.get('hdop', -1),
+                        "numsats": topside.get('numsats', 0),
+                        "fix_quality": topside.get('fix_quality', 1) if relative.get('position_valid', True) else 0,
+                        "fix_time": relative['fix_time']}
+            if 'timestamp' in relative:
+                position['timestamp'] = relative['timestamp']
+            if 'std' in relative:
+                position['horiz_accuracy'] = relative['std']
+            positions.append(position)
+        return positions
+
+
+def parse_mapping(text: str) -> Dict[str, str]:
+    """
+    Parses a locator to vehicle mapping of the command line, e.g.
+    "name=rov2,path=/api/v1/position/global,mavlink=http://192.168.2.3:6040,vehicle=1,gps_id=0"
+    "relative_path" is the acoustic position of the locator, used with --local_frame.
+    All keys are optional, missing ones default to the single locator and vehicle of the extension.
+    """
+    mapping = {}
+    for item in filter(None, text.split(",")):
+        key, separator, value = item.partition("=")
+        if not separator or key not in MAPPING_KEYS:
+            raise argparse.ArgumentTypeError(f"'{item}' is not one of {'=, '.join(MAPPING_KEYS)}=")
+        mapping[key] = value
+    for key in ("vehicle", "gps_id"):
+        if key in mapping and not mapping[key].isdigit():
+            raise argparse.ArgumentTypeError(f"{key} must be a number, not '{mapping[key]}'")
+    return mapping
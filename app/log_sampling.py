@@ -0,0 +1,37 @@
+import math
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+from loguru import logger
+
+
+class SampledLogger:
+    """
+    Rate limits frequent log messages, e.g. the ones logged on every forwarding cycle
+
+    The first occurrence of a message is logged, repeats within "interval" seconds are only counted
+    and reported with the next occurrence logged after it. An interval of 0 logs every occurrence.
+    """
+
+    def __init__(self, interval: float = 0.0, level: str = "INFO", clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self.level = level
+        self.clock = clock
+        self.lock = threading.Lock()
+        # message -> (time it was last logged, repeats not logged since)
+        self.messages: Dict[str, Tuple[float, int]] = {}
+
+    def log(self, message: str) -> None:
+        if self.interval > 0:
+            now = self.clock()
+            with self.lock:
+                logged, repeats = self.messages.get(message, (-math.inf, 0))
+                if now - logged < self.interval:
+                    self.messages[message] = (logged, repeats + 1)
+                    return
+                self.messages[message] = (now, 0)
+            if repeats:
+                message = f"{message} (repeated {repeats} times in {now - logged:.0f} s)"
+        # reported as logged by the caller
+        logger.opt(depth=1).log(self.level, message)
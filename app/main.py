@@ -1,79 +1,565 @@
 #!/usr/bin/python
 
+import json
+import math
+import sys
 import time
+import asyncio
+import threading
 import argparse
+from functools import partial
+from typing import Dict, List, Optional
 
 from loguru import logger
+from circuit_breaker import OPEN, Backoff
+from http_client import BACKENDS, HttpClient
 from mavlink2resthelper import Mavlink2RestHelper
+from mavlink_udp import MavlinkUdpConnection
 from ugps_connection import UgpsConnection
 from qgc_connection import QgcConnection
+from telemetry_cache import TelemetryCache
+from scheduler import DeadlineScheduler
+from change_filter import ChangeFilter
+from metrics import FIX_TO_AUTOPILOT_SECONDS, REGISTRY
+from status_server import EventStream, StatusServer
+from dashboard import PAGE, DashboardState
+from position_filter import KMH_TO_MS, PositionFilter
+from geo import offset_position
+from flight_recorder import DEPTH, ESTIMATE, LOCATOR, ORIENTATION, TOPSIDE, FlightRecorder
+from simulation import Simulation
+from log_sampling import SampledLogger
+from locators import DEFAULT_LOCATOR_PATH, DEFAULT_RELATIVE_PATH, Locator, LocatorTarget, TopsideReference, \
+    parse_mapping
 
 
 class UgpsExtension:
     """
     Main class for the BlueOS Extension for Water Linked Underwater GPS
     """
-    def __init__(self, args) -> None:
-        self.mavlink = Mavlink2RestHelper(host=args.mavlink_host, vehicle=1, component=220, get_vehicle=1, get_component=1)
-        self.ugps = UgpsConnection(host=args.ugps_host)
-        self.qgc = QgcConnection(ip=args.qgc_ip, port=14401)
+    def __init__(self, args, simulation: Optional[Simulation] = None) -> None:
+        self.args = args
+        # keep-alive connection pool shared by mavlink2rest and UGPS requests
+        self.http = HttpClient(timeout=(args.connect_timeout, args.read_timeout),
+                               failure_threshold=args.failure_threshold, max_backoff=args.max_backoff,
+                               backend=args.http_backend)
+        self.telemetry = None
+        if simulation is None:
+            # time source with time() and monotonic()
+            self.clock = time
+            # optionally subscribe to the telemetry stream instead of polling single fields
+            if args.mavlink_websocket:
+                self.telemetry = TelemetryCache(args.mavlink_host, ["VFR_HUD", "SCALED_PRESSURE2"], vehicle=1,
+                                                component=1)
+            # optionally send GPS_INPUT as binary MAVLink directly to a UDP endpoint instead of over mavlink2rest
+            udp = MavlinkUdpConnection(args.gps_input_udp, system_id=1) if args.gps_input_udp else None
+            self.mavlink = Mavlink2RestHelper(host=args.mavlink_host, vehicle=1, component=220, get_vehicle=1,
+                                              get_component=1, client=self.http, telemetry=self.telemetry, udp=udp)
+            self.ugps = UgpsConnection(host=args.ugps_host, client=self.http)
+            self.qgc = QgcConnection(ip=args.qgc_ip, port=14401, single_datagram=args.nmea_single_datagram,
+                                     destinations=args.nmea_udp or (), multicast=args.nmea_multicast,
+                                     multicast_ttl=args.nmea_multicast_ttl, tcp_port=args.nmea_tcp_port)
+            self.scheduler = DeadlineScheduler()
+        else:
+            # in-process stand-ins and simulated time
+            self.clock = simulation.clock
+            self.mavlink = simulation.mavlink
+            self.ugps = simulation.ugps
+            self.qgc = simulation.qgc
+            self.scheduler = simulation.scheduler()
+        self.simulation = simulation
+        # messages logged on every forwarding cycle, optionally rate limited
+        self.cycle_log = SampledLogger(args.log_sample_interval, clock=self.clock.monotonic)
+        # monotonic time forwarding started, and the seconds from then to the first GPS_INPUT
+        self.started = self.clock.monotonic()
+        self.time_to_first_fix: Optional[float] = None
+        # set on shutdown, ends the autopilot configuration running in worker threads
+        self.stopping = threading.Event()
+        # a VFR_HUD fetched within half a tick is reused, so depth and orientation share one request
+        self.snapshot_reuse = 0.5 / max(args.depth_rate, args.orientation_rate)
+        # latest valid temperature, updated at its own (lower) rate. Depth is sent with the fallback
+        # until the autopilot reports one, and with the last valid one while SCALED_PRESSURE2 is stale
+        self.temperature = args.fallback_temperature
+        # only forward new or changed data, plus a keepalive
+        self.depth_filter = ChangeFilter((args.depth_tolerance, args.temperature_tolerance), args.ugps_keepalive,
+                                         clock=self.clock.monotonic)
+        self.orientation_filter = ChangeFilter((args.orientation_tolerance,), args.ugps_keepalive, angular=True,
+                                               clock=self.clock.monotonic)
+        # latest topside position, converting relative locator positions with --local_frame
+        self.reference = TopsideReference(args.topside_max_age, self.clock.monotonic)
+        self.reference_valid = True
+        # locators polled from the UGPS, and the vehicles their fixes are sent to
+        self.locators: Dict[str, Locator] = {}
+        self.targets: List[LocatorTarget] = []
+        # mavlink2rest helpers of vehicles other than the one of --mavlink_host, by (host, vehicle, udp)
+        self.vehicles: Dict[tuple, Mavlink2RestHelper] = {}
+        for mapping in args.locator or [{}]:
+            self.add_target(mapping)
+        # latest heading of the vehicle, used as yaw of estimated positions
+        self.heading = float("nan")
+        # optional binary recording of everything forwarded, for analyzing dives afterwards
+        self.recorder = None
+        if args.recorder_path:
+            self.recorder = FlightRecorder(args.recorder_path, args.recorder_capacity)
+        # latest forwarded values, pushed to the status page of any number of browsers
+        self.dashboard = DashboardState(self.clock.time)
+        self.status_server = StatusServer(port=args.http_port)
+        self.status_server.add_route("/metrics", lambda: ("text/plain; version=0.0.4", REGISTRY.render().encode()))
+        self.status_server.add_route("/", lambda: ("text/html; charset=utf-8", PAGE))
+        self.status_server.add_route("/status", lambda: ("application/json", json.dumps(self.status()).encode()))
+        self.status_server.add_stream("/events", EventStream(partial(self.status, "events"),
+                                                             interval=args.dashboard_interval))
+        # lists the status page in the BlueOS menu
+        self.status_server.add_route("/register_service", lambda: ("application/json", json.dumps({
+            "name": "Water Linked UGPS", "description": "Status of the Water Linked Underwater GPS G2 forwarding",
+            "icon": "mdi-map-marker-radius", "company": "Water Linked", "version": "1.0.2", "webpage": "",
+            "api": ""}).encode()))
+        self.register_metrics()
 
-    def run(self) -> None:
-        self.setup_streamrates()
-        # Sets GPS type to MAVLINK
-        self.mavlink.set_param("GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 14)
+    def add_target(self, mapping: Dict[str, str]) -> None:
+        """
+        Sends the fixes of a locator to a vehicle, as configured by a --locator mapping
+        Every locator is polled once, no matter to how many vehicles its fixes are sent.
+        """
+        path = mapping.get("path", DEFAULT_LOCATOR_PATH)
+        locator = self.locators.get(path)
+        if locator is None:
+            # optional estimator between UGPS fixes and GPS_INPUT, published at its own rate
+            position_filter = None
+            if self.args.position_filter:
+                position_filter = PositionFilter(fix_accuracy=self.args.fix_accuracy,
+                                                 acceleration_noise=self.args.acceleration_noise,
+                                                 max_dead_reckoning=self.args.max_dead_reckoning)
+            locator = self.locators[path] = Locator(path, position_filter,
+                                                    mapping.get("relative_path", DEFAULT_RELATIVE_PATH))
+        host = mapping.get("mavlink", self.args.mavlink_host)
+        vehicle = int(mapping.get("vehicle", 1))
+        mavlink = self.mavlink
+        if self.simulation is None and ((host, vehicle) != (self.args.mavlink_host, 1) or "udp" in mapping):
+            # another vehicle, sharing the connection pool, and its helper with other locators sent to it
+            key = (host, vehicle, mapping.get("udp"))
+            mavlink = self.vehicles.get(key)
+            if mavlink is None:
+                udp = MavlinkUdpConnection(mapping["udp"], system_id=vehicle) if "udp" in mapping else None
+                mavlink = self.vehicles[key] = Mavlink2RestHelper(host=host, vehicle=vehicle, component=220,
+                                                                  get_vehicle=vehicle, get_component=1,
+                                                                  client=self.http, udp=udp)
+        name = mapping.get("name", f"vehicle{len(self.targets) + 1}")
+        self.targets.append(LocatorTarget(name, locator, mavlink, int(mapping.get("gps_id", 0)),
+                                          self.args.gps_keepalive, self.clock.monotonic))
 
-        self.ugps.wait_for_connection()
+    def run(self) -> None:
+        if self.recorder is not None and not self.recorder.open():
+            self.recorder = None
+        if self.args.http_port:
+            self.status_server.start()
+        self.qgc.start()
+        if self.telemetry is not None:
+            self.telemetry.start()
 
         logger.info("Running")
+        asyncio.run(self.forward())
 
-        update_period = 0.25
-        last_master_update = 0
-        last_locator_update = 0
-        last_position_update = 0
+    def run_simulation(self) -> None:
+        """
+        Runs the forwarding jobs against the stand-ins of the simulation, for its duration
+        Startup (stream rates, parameters, waiting for the UGPS) is skipped.
+        """
+        if self.recorder is not None and not self.recorder.open():
+            self.recorder = None
+        start = time.perf_counter()
+        asyncio.run(self.forward(until=self.simulation.duration))
+        real_seconds = time.perf_counter() - start
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.args.sim_output:
+            self.simulation.output.write(self.args.sim_output)
+        print("\n".join(self.simulation.report(real_seconds)))
 
-        while True:
-            time.sleep(0.02)
-            if time.time() > last_position_update + update_period:
-                last_position_update = time.time()
-                logger.info("Forwarding depth, temperature and orientation from mavlink to ugps")
-                # send depth and temprature information to upgs
-                self.ugps.send_locator_depth_temperature(self.mavlink.get_depth(), self.mavlink.get_temperature())
+    async def forward(self, until: float = math.inf) -> None:
+        """
+        Runs every forwarding stream as an independent job of a deadline scheduler, so that a slow or
+        unreachable endpoint only delays the streams that depend on it
+        Outside of simulations, jobs are only added once the endpoints they need are reachable, see startup().
+        Runs forever, or until the (simulated) monotonic clock reaches "until"
+        """
+        self.started = self.clock.monotonic()
+        if self.simulation is None:
+            startup = asyncio.create_task(self.startup())
+        else:
+            self.add_mavlink_jobs()
+            self.add_vehicle_jobs()
+            self.add_locator_jobs()
+            self.add_gps_jobs()
+            self.add_topside_jobs()
+        # first statistics after a full period, there are none to report at start
+        self.scheduler.add_job("stats", 1 / 60, self.log_stats, delay=60)
 
-                # Send heading to ugps
-                self.ugps.send_locator_orientation(self.mavlink.get_orientation())
+        if self.telemetry is not None:
+            # forward depth and heading as soon as they are streamed, the job rates act as fallback
+            self.telemetry.add_listener("VFR_HUD", lambda: self.scheduler.trigger("depth"))
+            self.telemetry.add_listener("VFR_HUD", lambda: self.scheduler.trigger("orientation"))
 
-            if time.time() > last_locator_update + update_period:
-                last_locator_update = time.time()
+        try:
+            await self.scheduler.run(until)
+        finally:
+            self.stopping.set()
+            if self.simulation is None:
+                startup.cancel()
 
-                logger.info("Forwarding locator position from ugps to mavlink")
-                locator_position = self.ugps.get_locator_position()
-                if locator_position:
-                    self.mavlink.send_gps_input(locator_position)
+    async def startup(self) -> None:
+        """
+        Probes the UGPS and mavlink2rest concurrently, and adds each forwarding job as soon as the endpoints
+        it needs are reachable. Stream rates and GPS_TYPE are configured meanwhile, without holding back forwarding.
+        """
+        ugps = asyncio.create_task(self.wait_for("UGPS", self.ugps.wait_for_connection))
+        mavlink = asyncio.create_task(self.wait_for("mavlink2rest", self.mavlink.wait_for_connection))
+
+        async def add_when_ready(add_jobs, *endpoints) -> None:
+            if all(await asyncio.gather(*endpoints)):
+                add_jobs()
+
+        async def configure_autopilot() -> None:
+            if not await mavlink:
+                return
+            await asyncio.gather(asyncio.to_thread(self.setup_streamrates),
+                                 asyncio.to_thread(self.setup_gps_type, self.mavlink))
+
+        async def add_vehicle(helper: Mavlink2RestHelper, targets: List[LocatorTarget]) -> None:
+            # other vehicles only get GPS_INPUT once their GPS_TYPE was set (or setting it gave up)
+            name = ", ".join(target.name for target in targets)
+            if not await self.wait_for(f"mavlink2rest of {name}", helper.wait_for_connection):
+                return
+            await asyncio.to_thread(self.setup_gps_type, helper)
+            if await ugps:
+                self.add_gps_jobs(targets)
 
-            if args.qgc_ip != "" and time.time() > last_master_update + update_period:
-                last_master_update = time.time()
+        own_targets = [target for target in self.targets if target.mavlink is self.mavlink]
 
-                logger.info("Forwarding topside position from upgs to qgc")
-                topside_position = self.ugps.get_ugps_topside_position()
-                if topside_position:
-                    self.qgc.send_topside_position(topside_position)
+        await asyncio.gather(
+            add_when_ready(self.add_topside_jobs, ugps),
+            add_when_ready(self.add_locator_jobs, ugps),
+            add_when_ready(self.add_mavlink_jobs, mavlink),
+            add_when_ready(self.add_vehicle_jobs, ugps, mavlink),
+            add_when_ready(partial(self.add_gps_jobs, own_targets), ugps, mavlink),
+            configure_autopilot(),
+            *(add_vehicle(helper, [target for target in self.targets if target.mavlink is helper])
+              for helper in self.vehicles.values()),
+        )
 
-    def setup_streamrates(self):
+    async def wait_for(self, name: str, wait_for_connection) -> bool:
+        """
+        Waits in a worker thread until an endpoint is reachable
+        Returns False if forwarding stopped before, so the thread ends on shutdown
+        """
+        if not await asyncio.to_thread(wait_for_connection, self.stopping):
+            return False
+        logger.info(f"{name} reachable after {self.clock.monotonic() - self.started:.1f} s")
+        return True
+
+    def add_mavlink_jobs(self) -> None:
+        # read from mavlink only
+        self.scheduler.add_job("temperature", self.args.temperature_rate, self.update_temperature)
+
+    def add_vehicle_jobs(self) -> None:
+        # read from mavlink, sent to the UGPS
+        self.scheduler.add_job("depth", self.args.depth_rate, self.forward_depth_temperature)
+        self.scheduler.add_job("orientation", self.args.orientation_rate, self.forward_orientation)
+
+    def add_locator_jobs(self) -> None:
+        if self.args.local_frame:
+            if not self.qgc.enabled:
+                # the topside job keeps the reference up to date otherwise
+                self.scheduler.add_job("reference", self.args.reference_rate, self.update_reference)
+            # one job for all locators, converting their positions with the same topside reference
+            self.scheduler.add_job("locators:relative", self.args.locator_rate, self.poll_relative_positions)
+            return
+        for locator in self.locators.values():
+            self.scheduler.add_job(f"locator:{locator.path}", self.args.locator_rate,
+                                   partial(self.poll_locator, locator))
+
+    def add_gps_jobs(self, targets: Optional[List[LocatorTarget]] = None) -> None:
+        # every vehicle is sent to by its own job, so a slow one does not delay the others
+        for target in self.targets if targets is None else targets:
+            if self.args.position_filter:
+                self.scheduler.add_job(f"gps:{target.name}", self.args.gps_rate,
+                                       partial(self.forward_position_estimate, target))
+            else:
+                # triggered by new poll results, the rate is a fallback
+                self.scheduler.add_job(f"gps:{target.name}", self.args.locator_rate,
+                                       partial(self.forward_locator_position, target))
+
+    def add_topside_jobs(self) -> None:
+        if self.qgc.enabled:
+            self.scheduler.add_job("topside", self.args.topside_rate, self.forward_topside_position)
+
+    def vehicle_snapshot(self):
+        """
+        Returns the latest VFR_HUD if recent enough, shared by the depth and orientation jobs running together
+        """
+        return self.mavlink.get_snapshot("VFR_HUD", self.args.telemetry_max_age, self.snapshot_reuse)
+
+    def update_temperature(self) -> None:
+        temperature = self.mavlink.get_temperature(
+            self.mavlink.get_snapshot("SCALED_PRESSURE2", self.args.telemetry_max_age))
+        # a missing or stale temperature must not hold back depth
+        if not math.isnan(temperature):
+            self.temperature = temperature
+
+    def forward_depth_temperature(self) -> None:
+        values = (self.mavlink.get_depth(self.vehicle_snapshot()), self.temperature)
+        # NaN (not available yet) can not be sent as JSON
+        if any(math.isnan(value) for value in values) or not self.depth_filter.should_send(values):
+            return
+        self.cycle_log.log("Forwarding depth and temperature from mavlink to ugps")
+        start = time.monotonic()
+        ok = self.ugps.send_locator_depth_temperature(*values)
+        if ok:
+            self.depth_filter.sent(values)
+        self.record(DEPTH, ok, values, start)
+
+    def forward_orientation(self) -> None:
+        values = (self.mavlink.get_orientation(self.vehicle_snapshot()),)
+        if math.isnan(values[0]) or not self.orientation_filter.should_send(values):
+            return
+        self.heading = values[0]
+        self.cycle_log.log("Forwarding orientation from mavlink to ugps")
+        start = time.monotonic()
+        ok = self.ugps.send_locator_orientation(*values)
+        if ok:
+            self.orientation_filter.sent(values)
+        self.record(ORIENTATION, ok, values, start)
+
+    def poll_locator(self, locator: Locator) -> None:
+        locator_position = self.ugps.get_position(locator.path)
+        if locator_position:
+            self.handle_locator_position(locator, locator_position)
+
+    def update_reference(self) -> None:
+        topside_position = self.ugps.get_ugps_topside_position()
+        if topside_position:
+            self.reference.update(topside_position)
+
+    def poll_relative_positions(self) -> None:
+        """
+        Polls the positions of all locators relative to the topside, and converts them to global positions
+        in one batch, so a slower topside poll does not limit the locator rate
+        """
+        if not self.reference.valid():
+            # the first topside poll may not be done yet right after start
+            if self.reference_valid and self.clock.monotonic() - self.started > self.args.topside_max_age:
+                logger.warning(f"No topside position with heading for {self.args.topside_max_age} s, "
+                               "relative locator positions can not be converted")
+                self.reference_valid = False
+            return
+        self.reference_valid = True
+        polled = [(locator, self.ugps.get_relative_position(locator.relative_path))
+                  for locator in self.locators.values()]
+        polled = [(locator, position) for locator, position in polled if position]
+        positions = self.reference.to_global([position for _, position in polled])
+        for (locator, _), position in zip(polled, positions):
+            # the locator is oriented like the vehicle, as the UGPS assumes for global positions
+            if not math.isnan(self.heading):
+                position['orientation'] = self.heading
+            self.handle_locator_position(locator, position)
+
+    def handle_locator_position(self, locator: Locator, locator_position: dict) -> None:
+        locator.update(locator_position)
+        if locator.position_filter is None:
+            for target in self.targets:
+                if target.locator is locator:
+                    self.scheduler.trigger(f"gps:{target.name}")
+            return
+        # new fixes update the filter, GPS_INPUT is sent by forward_position_estimate
+        if locator.new_fix and locator_position.get('fix_quality') != 0:
+            # the filter runs on monotonic time
+            fix_age = self.clock.time() - locator_position['fix_time']
+            locator.position_filter.update(locator_position, self.clock.monotonic() - fix_age)
+            locator.last_fix = locator_position
+            self.record(LOCATOR, True, self.fix_values(locator_position), time.monotonic(), fix_age)
+
+    def forward_locator_position(self, target: LocatorTarget) -> None:
+        locator = target.locator
+        # only new poll results are forwarded, nothing is sent while the UGPS is unreachable
+        if locator.polls == target.handled_polls:
+            return
+        target.handled_polls = locator.polls
+        locator_position = locator.position
+        if not target.filter.should_send(locator.fix):
+            return
+        fix = locator.fix
+        fix_time = locator_position['fix_time']
+        self.cycle_log.log(f"Forwarding locator position from ugps to mavlink ({target.name})")
+        if self.args.project_fixes:
+            locator_position = self.project_position(locator_position, self.clock.time())
+        start = time.monotonic()
+        ok = target.mavlink.send_gps_input(locator_position, target.gps_id)
+        fix_age = self.clock.time() - fix_time
+        if ok:
+            target.filter.sent(fix)
+            FIX_TO_AUTOPILOT_SECONDS.observe(fix_age)
+            self.sent_gps_input()
+        self.record(LOCATOR, ok, self.fix_values(locator_position), start, fix_age)
+
+    @staticmethod
+    def fix_values(position: dict) -> tuple:
+        """
+        Returns the values of a locator fix kept in the flight recording
+        """
+        return (position['lat'], position['lon'], position.get('hdop', math.nan),
+                position.get('fix_quality', math.nan))
+
+    @staticmethod
+    def project_position(position: dict, now: float) -> dict:
+        """
+        Moves a position along its course over ground by the distance travelled since it was measured,
+        and stamps it with the current time "now"
+        """
+        distance = position.get('sog', 0) * KMH_TO_MS * (now - position['fix_time'])
+        course = math.radians(position.get('cog', 0))
+        lat, lon = offset_position(position['lat'], position['lon'],
+                                   distance * math.cos(course), distance * math.sin(course))
+        return dict(position, lat=lat, lon=lon, fix_time=now)
+
+    def forward_position_estimate(self, target: LocatorTarget) -> None:
+        locator = target.locator
+        estimate = locator.position_filter.estimate(self.clock.monotonic())
+        if estimate is None:
+            return
+        # quality fields are taken from the latest fix, the estimate is valid now
+        position = dict(locator.last_fix, fix_time=self.clock.time(), **estimate)
+        # the heading is only known of the vehicle depth and orientation are forwarded from
+        if target.mavlink is self.mavlink and not math.isnan(self.heading):
+            position['orientation'] = self.heading
+        logger.debug("Forwarding estimated locator position from ugps to mavlink ({}): {}", target.name, position)
+        start = time.monotonic()
+        ok = target.mavlink.send_gps_input(position, target.gps_id)
+        if ok:
+            self.sent_gps_input()
+        self.record(ESTIMATE, ok, (estimate['lat'], estimate['lon'], estimate['horiz_accuracy'],
+                                   math.hypot(estimate['vn'], estimate['ve'])), start)
+
+    def forward_topside_position(self) -> None:
+        self.cycle_log.log("Forwarding topside position from upgs to qgc")
+        topside_position = self.ugps.get_ugps_topside_position()
+        if topside_position:
+            self.reference.update(topside_position)
+            start = time.monotonic()
+            ok = self.qgc.send_topside_position(topside_position)
+            self.record(TOPSIDE, ok, (topside_position['lat'], topside_position['lon'],
+                                      topside_position.get('hdop', math.nan), topside_position['orientation']),
+                        start, self.clock.time() - topside_position['fix_time'])
+
+    def record(self, kind: int, ok: bool, values, start: float, latency: float = math.nan) -> None:
+        """
+        Adds a forwarded sample to the flight recording and the status page,
+        "start" is the (real) monotonic time sending started
+        """
+        timestamp = self.clock.time()
+        self.dashboard.update(kind, ok, values, latency, timestamp)
+        if self.recorder is not None:
+            self.recorder.record(kind, ok, values, time.monotonic() - start, latency, timestamp)
+
+    def status(self, consumer: str = "status") -> dict:
+        """
+        Returns the state shown on the status page, from memory only
+        Rates are since the previous call of the same consumer, see DashboardState.snapshot().
+        """
+        status = self.dashboard.snapshot(consumer)
+        status["hosts"] = {host: breaker.state for host, breaker in list(self.http.breakers.items())}
+        status["time_to_first_fix"] = self.time_to_first_fix
+        return status
+
+    def log_stats(self) -> None:
+        if self.recorder is not None:
+            self.recorder.flush()
+        for host, stats in self.http.connection_stats().items():
+            logger.info(f"HTTP connections to {host}: {stats['opened']} opened, {stats['reused']} reused")
+        for name, stats in self.scheduler.stats().items():
+            logger.info(f"Job {name}: {stats['runs']} runs, {stats['overruns']} overruns, {stats['dropped']} dropped, "
+                        f"jitter mean {stats['mean_jitter'] * 1000:.1f} ms, max {stats['max_jitter'] * 1000:.1f} ms")
+
+    def register_metrics(self) -> None:
+        """
+        Exports scheduler and connection pool statistics on /metrics
+        """
+        def job_stat(key):
+            return lambda: (({"job": name}, stats[key]) for name, stats in self.scheduler.stats().items())
+
+        def connection_stat(key):
+            return lambda: (({"host": host}, stats[key]) for host, stats in self.http.connection_stats().items())
+
+        REGISTRY.register_collector("ugps_job_runs_total", "counter", "Runs of each forwarding job", job_stat("runs"))
+        REGISTRY.register_collector("ugps_job_overruns_total", "counter",
+                                    "Ticks of a job that arrived while its previous run was still busy",
+                                    job_stat("overruns"))
+        REGISTRY.register_collector("ugps_job_dropped_total", "counter", "Ticks of a job that were not executed",
+                                    job_stat("dropped"))
+        REGISTRY.register_collector("ugps_circuit_open", "gauge",
+                                    "1 while requests to a host are paused because it is unreachable",
+                                    lambda: (({"host": host}, int(breaker.state == OPEN))
+                                             for host, breaker in list(self.http.breakers.items())))
+        REGISTRY.register_collector("ugps_circuit_short_circuited_total", "counter",
+                                    "Requests not sent because their host was unreachable",
+                                    lambda: (({"host": host}, breaker.short_circuited)
+                                             for host, breaker in list(self.http.breakers.items())))
+        REGISTRY.register_collector("ugps_time_to_first_fix_seconds", "gauge",
+                                    "Seconds from start to the first GPS_INPUT sent to the autopilot",
+                                    lambda: [] if self.time_to_first_fix is None else [({}, self.time_to_first_fix)])
+        REGISTRY.register_collector("ugps_http_connections_opened_total", "counter",
+                                    "HTTP connections opened per host", connection_stat("opened"))
+        REGISTRY.register_collector("ugps_http_connections_reused_total", "counter",
+                                    "HTTP requests that reused a pooled connection, per host",
+                                    connection_stat("reused"))
+
+    def setup_streamrates(self) -> None:
         """
         Setup message streams to get Orientation(VFR_HUD), Depth(VFR_HUD), and temperature(SCALED_PRESSURE2)
+        All intervals are requested at once, then verified by reading back the frequency measured by mavlink2rest.
+        Streams that did not reach their frequency are requested again, with an increasing delay,
+        up to --setup_attempts times, e.g. SCALED_PRESSURE2 never arrives without an external pressure sensor.
+        """
+        # VFR_HUD at at least 5Hz, SCALED_PRESSURE2 at at least 1Hz
+        pending = {"VFR_HUD": 5, "SCALED_PRESSURE2": 1}
+        backoff = Backoff(initial=1.0, maximum=self.args.max_backoff)
+        for attempt in range(1, self.args.setup_attempts + 1):
+            requested = {name: frequency for name, frequency in pending.items()
+                         if self.mavlink.ensure_message_frequency(name, frequency)}
+            # give mavlink2rest time to measure the new frequencies
+            if self.stopping.wait(backoff.next()):
+                return
+            pending = {name: frequency for name, frequency in pending.items()
+                       if name not in requested or not self.mavlink.message_frequency_reached(name, frequency)}
+            if not pending:
+                logger.info(f"Message streams verified after {self.clock.monotonic() - self.started:.1f} s")
+                return
+            if attempt < self.args.setup_attempts:
+                logger.info(f"Streams not at their frequency yet: {', '.join(pending)}")
+        logger.warning(f"Giving up on streams {', '.join(pending)} after {self.args.setup_attempts} attempts, "
+                       "they are forwarded at the rate the autopilot sends them")
+
+    def setup_gps_type(self, mavlink: Mavlink2RestHelper) -> None:
+        """
+        Sets GPS type of the vehicle of "mavlink" to MAVLINK, unless it already is, up to --setup_attempts times
         """
-        # VFR_HUD at at least 5Hz
-        while not self.mavlink.ensure_message_frequency("VFR_HUD", 5):
-            time.sleep(2)
+        backoff = Backoff(initial=1.0, maximum=self.args.max_backoff)
+        for _ in range(self.args.setup_attempts):
+            if mavlink.ensure_param("GPS_TYPE", "MAV_PARAM_TYPE_UINT8", 14):
+                return
+            if self.stopping.wait(backoff.next()):
+                return
+        logger.warning(f"Could not set GPS_TYPE to 14 (MAVLink) of vehicle {mavlink.get_vehicle} at {mavlink.host} "
+                       f"after {self.args.setup_attempts} attempts, please set it in the autopilot parameters")
 
-        # SCALED_PRESSURE2 at at least 1Hz
-        while not self.mavlink.ensure_message_frequency("SCALED_PRESSURE2", 1):
-            time.sleep(2)
+    def sent_gps_input(self) -> None:
+        """
+        Reports the time to the first GPS_INPUT after start
+        """
+        if self.time_to_first_fix is None:
+            self.time_to_first_fix = self.clock.monotonic() - self.started
+            logger.info(f"First GPS_INPUT sent {self.time_to_first_fix:.1f} s after start")
 
 
-if __name__ == "__main__":
-    logger.info("Starting BlueOS extension for Water Linked Underwater GPS G2.")
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="BlueOS extension for Water Linked Underwater GPS G2.\
                                      The defaults of the command line arguments allow for easy testing of \
                                      the extension in a development environment, see the dockerfile for \
@@ -87,7 +573,146 @@ if __name__ == "__main__":
     parser.add_argument('--qgc_ip', action="store", type=str, default="192.168.2.2",
                         help="IP address to send UGPS Topside position via UDP to. Set to '' \
                             to not send any NMEA-strings over UDP.")
+    parser.add_argument('--nmea_udp', action="append", type=str,
+                        help="Additional host:port to send the NMEA sentences of the topside position to over UDP, \
+                            e.g. a logging PC or chart plotter. Can be given several times.")
+    parser.add_argument('--nmea_multicast', action="store", type=str, default="",
+                        help="Multicast group:port to send the NMEA sentences to, e.g. 239.192.0.1:10110.")
+    parser.add_argument('--nmea_multicast_ttl', action="store", type=int, default=1,
+                        help="Number of router hops NMEA multicast may pass, 1 keeps it in the local network.")
+    parser.add_argument('--nmea_tcp_port', action="store", type=int, default=0,
+                        help="Serve the NMEA sentences to TCP clients on this port (10110 by convention). \
+                            0 to disable.")
+    parser.add_argument('--nmea_single_datagram', action="store_true",
+                        help="Send the NMEA sentences of each topside position in a single UDP datagram.")
+    parser.add_argument('--http_port', action="store", type=int, default=80,
+                        help="Port to serve the status page (/), its live updates (/events), the status as JSON \
+                            (/status) and Prometheus metrics (/metrics) on. Set to 0 to disable.")
+    parser.add_argument('--dashboard_interval', action="store", type=float, default=1.0,
+                        help="Seconds between updates pushed to the status page, shared by all open pages.")
+    parser.add_argument('--http_backend', action="store", type=str, default="requests", choices=BACKENDS,
+                        help="Library to send HTTP requests with, 'stdlib' takes less memory and starts faster, \
+                            as it does not load requests and urllib3.")
+    parser.add_argument('--log_level', action="store", type=str, default="DEBUG",
+                        help="Minimum level of logged messages. Debug messages (requests and responses) are only \
+                            formatted if this is DEBUG.")
+    parser.add_argument('--log_sample_interval', action="store", type=float, default=0.0,
+                        help="Log the messages of every forwarding cycle at most once per this many seconds, \
+                            with the number of repeats. 0 logs every cycle.")
+    parser.add_argument('--connect_timeout', action="store", type=float, default=1.0,
+                        help="Timeout in seconds for establishing HTTP connections to UGPS and mavlink2rest.")
+    parser.add_argument('--read_timeout', action="store", type=float, default=1.0,
+                        help="Timeout in seconds for waiting on HTTP responses from UGPS and mavlink2rest.")
+    parser.add_argument('--failure_threshold', action="store", type=int, default=3,
+                        help="Consecutive failed requests after which a host is considered down and requests \
+                            to it are paused, apart from probes with an increasing interval.")
+    parser.add_argument('--max_backoff', action="store", type=float, default=8.0,
+                        help="Maximum interval in seconds between probes of a host that is down.")
+    parser.add_argument('--setup_attempts', action="store", type=int, default=5,
+                        help="Attempts to configure the message streams and GPS_TYPE of the autopilot before \
+                            giving up with a warning.")
+    parser.add_argument('--gps_input_udp', action="store", type=str, default="",
+                        help="Send GPS_INPUT as binary MAVLink v2 over UDP to this host:port (e.g. an endpoint of \
+                            the MAVLink router, 192.168.2.2:14550) instead of over mavlink2rest.")
+    parser.add_argument('--mavlink_websocket', action="store_true",
+                        help="Subscribe to VFR_HUD and SCALED_PRESSURE2 over the mavlink2rest websocket \
+                            instead of polling each field over HTTP.")
+    parser.add_argument('--telemetry_max_age', action="store", type=float, default=3.0,
+                        help="Maximum age in seconds of mavlink telemetry (VFR_HUD, SCALED_PRESSURE2) forwarded to \
+                            the UGPS, older data is not forwarded, e.g. when the autopilot stopped streaming it.")
+    parser.add_argument('--depth_rate', action="store", type=float, default=4.0,
+                        help="Rate in Hz to forward depth and temperature from mavlink to UGPS.")
+    parser.add_argument('--temperature_rate', action="store", type=float, default=1.0,
+                        help="Rate in Hz to read the water temperature from mavlink.")
+    parser.add_argument('--fallback_temperature', action="store", type=float, default=10.0,
+                        help="Water temperature in degrees Celsius sent to UGPS with the depth until the autopilot \
+                            reports one, e.g. on vehicles without external pressure sensor (SCALED_PRESSURE2).")
+    parser.add_argument('--orientation_rate', action="store", type=float, default=4.0,
+                        help="Rate in Hz to forward orientation from mavlink to UGPS.")
+    parser.add_argument('--locator_rate', action="store", type=float, default=4.0,
+                        help="Rate in Hz to forward the locator position from UGPS to mavlink (GPS_INPUT).")
+    parser.add_argument('--topside_rate', action="store", type=float, default=4.0,
+                        help="Rate in Hz to forward the topside position from UGPS to QGC.")
+    parser.add_argument('--gps_keepalive', action="store", type=float, default=1.0,
+                        help="Seconds after which an unchanged locator position is forwarded to mavlink again.")
+    parser.add_argument('--ugps_keepalive', action="store", type=float, default=1.0,
+                        help="Seconds after which unchanged depth, temperature and orientation are sent to UGPS again.")
+    parser.add_argument('--depth_tolerance', action="store", type=float, default=0.01,
+                        help="Depth change in meters below which depth is not sent to UGPS before the keepalive.")
+    parser.add_argument('--temperature_tolerance', action="store", type=float, default=0.1,
+                        help="Temperature change in degrees Celsius below which it is not sent to UGPS before \
+                            the keepalive.")
+    parser.add_argument('--orientation_tolerance', action="store", type=float, default=0.5,
+                        help="Heading change in degrees below which it is not sent to UGPS before the keepalive.")
+    parser.add_argument('--recorder_path', action="store", type=str, default="",
+                        help="File to record everything forwarded into, e.g. \
+                            /root/.config/ugps_extension/flight_recording.bin. Empty to not record.")
+    parser.add_argument('--recorder_capacity', action="store", type=int, default=100000,
+                        help="Number of samples kept in the flight recording (52 bytes each), \
+                            the oldest are overwritten.")
+    parser.add_argument('--locator', action="append", type=parse_mapping,
+                        help="Sends the fixes of a locator to a vehicle, can be given several times, e.g. \
+                            'name=rov2,mavlink=http://192.168.2.3:6040,vehicle=1,gps_id=0'. \
+                            Add udp=host:port to send its GPS_INPUT as in --gps_input_udp. All keys are optional, \
+                            by default the locator at /api/v1/position/global is sent to vehicle 1 of --mavlink_host. \
+                            Every locator is polled once for all its vehicles. GPS_TYPE is set to MAVLink on every \
+                            vehicle. Depth and orientation are forwarded from --mavlink_host only.")
+    parser.add_argument('--position_filter', action="store_true",
+                        help="Filter the locator fixes and dead reckon between them, publishing GPS_INPUT \
+                            with velocity and accuracy at --gps_rate.")
+    parser.add_argument('--gps_rate', action="store", type=float, default=10.0,
+                        help="Rate in Hz to publish filtered locator positions as GPS_INPUT.")
+    parser.add_argument('--fix_accuracy', action="store", type=float, default=1.0,
+                        help="Horizontal standard deviation in meters of a locator fix with HDOP 1.")
+    parser.add_argument('--acceleration_noise', action="store", type=float, default=0.5,
+                        help="Standard deviation in m/s^2 of the vehicle acceleration, assumed by the position filter.")
+    parser.add_argument('--max_dead_reckoning', action="store", type=float, default=3.0,
+                        help="Seconds without locator fix after which the position filter stops publishing.")
+    parser.add_argument('--project_fixes', action="store_true",
+                        help="Move locator fixes along their course over ground by the distance travelled \
+                            since they were measured, before forwarding them as GPS_INPUT.")
+    parser.add_argument('--local_frame', action="store_true",
+                        help="Poll the acoustic locator positions relative to the topside (relative_path of \
+                            --locator) and convert them to global positions with the latest topside position, \
+                            so the topside GPS rate does not limit the locator rate.")
+    parser.add_argument('--reference_rate', action="store", type=float, default=1.0,
+                        help="Rate in Hz to poll the topside position with --local_frame, if it is not \
+                            forwarded to QGC anyway.")
+    parser.add_argument('--topside_max_age', action="store", type=float, default=5.0,
+                        help="Seconds a topside position is used to convert relative locator positions.")
+    parser.add_argument('--simulate', action="store", type=str, default="",
+                        help="Instead of connecting to UGPS and mavlink2rest, run against simulated ones: \
+                            'lawnmower' for a synthetic survey, or the path of a flight recording to replay.")
+    parser.add_argument('--sim_speed', action="store", type=float, default=0.0,
+                        help="How many times faster than real time to simulate, 0 to run as fast as \
+                            possible in virtual time (reproducible).")
+    parser.add_argument('--sim_duration', action="store", type=float, default=0.0,
+                        help="Simulated seconds, 0 for the whole flight recording or an hour of survey.")
+    parser.add_argument('--sim_output', action="store", type=str, default="",
+                        help="File to write everything sent during the simulation to, as JSON lines.")
+    parser.add_argument('--sim_seed', action="store", type=int, default=0,
+                        help="Seed of the random fix noise and dropouts of the simulated survey.")
+    parser.add_argument('--sim_dropout_rate', action="store", type=float, default=0.1,
+                        help="Fraction of time the simulated survey loses the acoustic link.")
+    parser.add_argument('--sim_log_level', action="store", type=str, default="WARNING",
+                        help="Log level during simulations, e.g. INFO to log every forwarded sample.")
+    return parser
+
+
+if __name__ == "__main__":
+    logger.info("Starting BlueOS extension for Water Linked Underwater GPS G2.")
+    parser = build_parser()
     args = parser.parse_args()
 
-    service = UgpsExtension(args)
-    service.run()
+    if args.simulate:
+        if args.nmea_tcp_port:
+            parser.error("--nmea_tcp_port is not supported in simulations, NMEA over TCP has no stand-in")
+        logger.remove()
+        logger.add(sys.stderr, level=args.sim_log_level)
+        service = UgpsExtension(args, Simulation.from_args(args))
+        service.run_simulation()
+    else:
+        logger.remove()
+        logger.add(sys.stderr, level=args.log_level)
+        service = UgpsExtension(args)
+        service.run()
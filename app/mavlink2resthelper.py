@@ -1,9 +1,122 @@
+import json
 import math
-from typing import Any, Optional
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set, Tuple
 
-import requests
 from loguru import logger
 
+from circuit_breaker import Backoff, CircuitOpenError
+from http_client import HttpClient
+from mavlink_udp import MavlinkUdpConnection
+from metrics import STALE_TELEMETRY
+from telemetry_cache import TelemetryCache
+
+
+# GPS_INPUT_IGNORE_FLAGS, fields of GPS_INPUT the autopilot should not use
+GPS_INPUT_IGNORE_FLAG_ALT = 1
+GPS_INPUT_IGNORE_FLAG_HDOP = 2
+GPS_INPUT_IGNORE_FLAG_VDOP = 4
+GPS_INPUT_IGNORE_FLAG_VEL_HORIZ = 8
+GPS_INPUT_IGNORE_FLAG_VEL_VERT = 16
+GPS_INPUT_IGNORE_FLAG_SPEED_ACCURACY = 32
+GPS_INPUT_IGNORE_FLAG_HORIZONTAL_ACCURACY = 64
+GPS_INPUT_IGNORE_FLAG_VERTICAL_ACCURACY = 128
+
+
+# ids of the messages streamed for forwarding, to request their interval
+MESSAGE_IDS = {
+    "VFR_HUD": 74,
+    "SCALED_PRESSURE2": 137
+}
+# a stream at 80% of the requested frequency counts as running, mavlink2rest measures it with some jitter
+FREQUENCY_TOLERANCE = 0.8
+# seconds between checks for the PARAM_VALUE answering a request
+PARAM_POLL_INTERVAL = 0.05
+
+
+# Start of GPS time (1980-01-06) as UNIX time, and the GPS-UTC leap seconds
+GPS_EPOCH = 315964800
+GPS_LEAP_SECONDS = 18
+SECONDS_PER_WEEK = 604800
+
+
+def gps_week_time(unix_time: float):
+    """
+    Converts UNIX time to GPS time
+    Returns (GPS week, milliseconds into the week)
+    """
+    gps_time = unix_time - GPS_EPOCH + GPS_LEAP_SECONDS
+    week, seconds = divmod(gps_time, SECONDS_PER_WEEK)
+    return int(week), int(seconds * 1000)
+
+
+def parse_iso_time(text: str) -> float:
+    """
+    Parses an RFC 3339 time of mavlink2rest (nanosecond fractions) as UNIX time
+    Fractions are cut to microseconds, which is all datetime can hold.
+    """
+    text = re.sub(r"(\.\d{6})\d+", r"\1", text.replace("Z", "+00:00"))
+    return datetime.fromisoformat(text).timestamp()
+
+
+class MessageSnapshot(NamedTuple):
+    """
+    A mavlink message with the time it was received, all fields read from it belong to the same message
+    """
+    message: dict
+    # UNIX time mavlink2rest (or the websocket subscription) received the message
+    received: float
+
+    def get_float(self, field: str) -> float:
+        """
+        Returns a field as float, nan if not available
+        """
+        try:
+            return float(self.message[field])
+        except Exception:
+            return float("nan")
+
+
+class MavlinkTemplateRegistry:
+    """
+    Caches the message templates served by mavlink2rest's /helper/mavlink endpoint
+
+    Each template is fetched once and handed out as an independent copy, so sending a message
+    does not need an extra request. Templates are dropped when mavlink2rest rejects a message
+    built from them (schema mismatch) or becomes unreachable (e.g. restarts), and fetched again on next use.
+    """
+
+    def __init__(self, fetch: Callable[[str], Optional[dict]]):
+        # fetch(name) requests the template of a message from mavlink2rest
+        self.fetch = fetch
+        # templates are stored serialized, as parsing is cheaper than a deep copy
+        self.templates: Dict[str, str] = {}
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        Returns a copy of the template for message "name", None if it is not available
+        """
+        serialized = self.templates.get(name)
+        if serialized is None:
+            template = self.fetch(name)
+            if template is None:
+                return None
+            serialized = json.dumps(template)
+            self.templates[name] = serialized
+        return json.loads(serialized)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Drops the cached template of message "name", or all templates if no name is given
+        """
+        if name is None:
+            self.templates.clear()
+        else:
+            self.templates.pop(name, None)
+
 
 class Mavlink2RestBase:
     """
@@ -11,17 +124,38 @@ class Mavlink2RestBase:
     This class is supposed to be usecase independant.
 
     Exception handling: All exceptions are caught and reported over logging. Severity "error", as they should not happen.
+    Requests skipped while the host is known to be down are only logged at "debug" level.
     """
 
-    def __init__(self, host: str = "http://127.0.0.1/mavlink2rest", vehicle: int = 1, component: int = 220, get_vehicle: int = 1, get_component: int = 1):
+    def __init__(self, host: str = "http://127.0.0.1/mavlink2rest", vehicle: int = 1, component: int = 220, get_vehicle: int = 1, get_component: int = 1,
+                 client: Optional[HttpClient] = None, telemetry: Optional[TelemetryCache] = None,
+                 udp: Optional[MavlinkUdpConnection] = None, clock=time):
         # store mavlink-url, vehicle and component to access telemetry data from
         self.host = host
+        # pooled keep-alive connections, may be shared with other API clients
+        self.client = client or HttpClient()
+        # optional websocket subscription, streamed messages are then read from memory instead of requested
+        self.telemetry = telemetry
+        # optional direct MAVLink connection, messages that support it are sent as binary frames instead of over REST
+        self.udp = udp
         # default own role in mavlink protocol (for sending data)
         self.vehicle = vehicle
         self.component = component  # default for post
         # default for acquiring data (e.g. from flight controller)
         self.get_vehicle = get_vehicle
         self.get_component = get_component
+        # message templates, fetched once from mavlink2rest
+        self.templates = MavlinkTemplateRegistry(lambda name: self.get(f"/helper/mavlink?name={name}"))
+        # time source with time() and monotonic(), to tell the age of messages
+        self.clock = clock
+        # message type -> (latest snapshot, monotonic time it was fetched), and a lock per message type,
+        # so jobs running concurrently wait for a fetch in flight instead of requesting the message again
+        self.snapshots: Dict[str, Tuple[Optional[MessageSnapshot], float]] = {}
+        self.snapshot_locks: Dict[str, threading.Lock] = {}
+        # message type -> (counter, time it was first seen), for messages without a usable timestamp
+        self.counters: Dict[str, Tuple[Any, float]] = {}
+        # message types currently too old to be used
+        self.stale: Set[str] = set()
 
     def get(self, path: str):
         """
@@ -29,20 +163,27 @@ class Mavlink2RestBase:
         Returns the response object or None on failure
         """
         full_url = self.host + path
-        logger.debug(f"Request url: {full_url}")
+        logger.debug("Request url: {}", full_url)
         response = None
         try:
-            response = requests.get(full_url)
+            response = self.client.get(full_url)
             if response.status_code == 200:
-                logger.debug(f"Got response: {response.text}")
-                if response.text == "None":
+                # decoding the body is skipped unless debug logging is enabled
+                logger.opt(lazy=True).debug("Got response: {}", lambda: response.text)
+                if response.content == b"None":
                     return None
                 return response.json()
             else:
                 logger.error(f"Got HTTP Error: {response.status_code} {response.reason} {response.text}")
                 return None
+        except CircuitOpenError as e:
+            # the outage was already reported when the circuit opened
+            logger.debug("Skipped request: {}", e)
+            return None
         except Exception as e:
             logger.error(f"Got exception: {e}")
+            # mavlink2rest may be restarting, templates have to be fetched again
+            self.templates.invalidate()
             return None
 
     def get_message(self, path: str, vehicle: Optional[int] = None, component: Optional[int] = None) -> Optional[str]:
@@ -71,70 +212,208 @@ class Mavlink2RestBase:
             result = float("nan")
         return result
 
+    def get_snapshot(self, message_name: str, max_age: float = math.inf,
+                     reuse: float = 0.0) -> Optional[MessageSnapshot]:
+        """
+        Get the latest mavlink message of a type with its receive time, in a single request
+        Reads from the websocket telemetry cache if available. A snapshot fetched less than "reuse" seconds ago
+        is returned again, so streams forwarded at the same time share one request.
+        Example: get_snapshot('VFR_HUD', max_age=3.0).get_float('alt')
+        Returns the snapshot, or None on failure or if the message is older than "max_age" seconds
+        """
+        with self.snapshot_locks.setdefault(message_name, threading.Lock()):
+            now = self.clock.monotonic()
+            cached = self.snapshots.get(message_name)
+            if cached is not None and now - cached[1] < reuse:
+                snapshot = cached[0]
+            else:
+                snapshot = self._fetch_snapshot(message_name)
+                self.snapshots[message_name] = (snapshot, self.clock.monotonic())
+        if snapshot is None:
+            return None
+
+        age = self.clock.time() - snapshot.received
+        if age > max_age:
+            STALE_TELEMETRY.inc(message=message_name)
+            if message_name not in self.stale:
+                self.stale.add(message_name)
+                logger.warning(f"{message_name} is {age:.1f} s old, not using it until a new one is received")
+            return None
+        if message_name in self.stale:
+            self.stale.discard(message_name)
+            logger.info(f"{message_name} is received again")
+        return snapshot
+
+    def _fetch_snapshot(self, message_name: str) -> Optional[MessageSnapshot]:
+        if self.telemetry is not None:
+            entry = self.telemetry.get(message_name)
+            if entry is not None:
+                return MessageSnapshot(*entry)
+        response = self.get_message(f"/{message_name}")
+        try:
+            message = response["message"]
+            information = response["message_information"]
+        except Exception:
+            return None
+        try:
+            return MessageSnapshot(message, parse_iso_time(information["time"]["last_message"]))
+        except Exception:
+            pass
+        # without a usable timestamp, the message is as old as the time its counter last changed
+        now = self.clock.time()
+        counter = information.get("counter")
+        previous = self.counters.get(message_name)
+        if previous is None or previous[0] != counter:
+            previous = self.counters[message_name] = (counter, now)
+        return MessageSnapshot(message, previous[1])
+
     def post(self, path: str, json: object) -> bool:
         """
         Helper to request with POST from mavlink2rest
         Returns if request was successful
         """
         full_url = self.host + path
-        logger.debug(f"Request url: {full_url} json: {json}")
+        logger.debug("Request url: {} json: {}", full_url, json)
         response = None
         try:
-            response = requests.post(full_url, json=json)
+            response = self.client.post(full_url, json=json)
             if response.status_code == 200:
-                logger.debug(f"Got response: {response.reason}")
+                logger.debug("Got response: {}", response.reason)
                 return True
             else:
                 logger.error(f"Got HTTP Error: {response.status_code} {response.reason} {response.text}")
                 return False
+        except CircuitOpenError as e:
+            # the outage was already reported when the circuit opened
+            logger.debug("Skipped request: {}", e)
+            return False
         except Exception as e:
             logger.error(f"Got exception: {e}")
+            # mavlink2rest may be restarting, templates have to be fetched again
+            self.templates.invalidate()
             return False
 
-    def ensure_message_frequency(self, message_name: str, frequency: int) -> bool:
+    def wait_for_connection(self, stop: Optional[threading.Event] = None) -> bool:
+        """
+        Waits until mavlink2rest is available, retrying with an increasing delay
+        Fetches the COMMAND_LONG template on the way, as configuring the autopilot needs it first.
+        Returns True when it is available, False if "stop" was set before
+        """
+        stop = stop or threading.Event()
+        backoff = Backoff()
+        while self.templates.get("COMMAND_LONG") is None:
+            logger.info("Waiting for mavlink2rest...")
+            if stop.wait(backoff.next()):
+                return False
+        return True
+
+    def get_message_frequency(self, message_name: str) -> float:
+        """
+        Returns the frequency a mavlink message is received at, as measured by mavlink2rest (0 if unknown)
+        """
+        frequency = self.get_float(f"/{message_name.upper()}/message_information/frequency")
+        return 0.0 if math.isnan(frequency) else frequency
+
+    def ensure_message_frequency(self, message_name: str, frequency: float) -> bool:
         """
         Makes sure that a mavlink message is being received at least at "frequency" Hertz
+        The interval is only requested if the message is slower, the new frequency takes mavlink2rest a moment
+        to measure, see message_frequency_reached().
         Returns true if successful, false otherwise
         """
-        msg_ids = {
-            "VFR_HUD": 74,
-            "SCALED_PRESSURE2": 137
-        }
         message_name = message_name.upper()
+        previous_frequency = self.get_message_frequency(message_name)
+        if previous_frequency >= frequency * FREQUENCY_TOLERANCE:
+            logger.info(f"{message_name} already received at {previous_frequency:.1f} Hz")
+            return True
 
         logger.info(f"Trying to set message frequency of {message_name} to {frequency} Hz")
 
-        previous_frequency = self.get_float(f"/{message_name}/message_information/frequency")
-        if math.isnan(previous_frequency):
-            previous_frequency = 0.0
-
         # load message template from mavlink2rest helper
-        command = self.get("/helper/mavlink?name=COMMAND_LONG")
+        command = self.templates.get("COMMAND_LONG")
         if command is None:
             return False
 
         try:
-            msg_id = msg_ids[message_name]
-            # msg_id = getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + message_name)
+            msg_id = MESSAGE_IDS[message_name]
         except Exception:
             logger.error(f"{message_name} not in internal LUT")
             return False
 
         command["message"]["command"] = {"type": "MAV_CMD_SET_MESSAGE_INTERVAL"}
         command["message"]["param1"] = msg_id
-        command["message"]["param2"] = int(1000 / frequency)
+        # interval in microseconds
+        command["message"]["param2"] = int(1e6 / frequency)
 
         success = self.post("/mavlink", json=command)
         if success:
-            logger.info(f"Successfully set message frequency of {message_name} to {frequency} Hz, was {previous_frequency} Hz")
+            logger.info(f"Requested message frequency of {message_name} at {frequency} Hz, was {previous_frequency} Hz")
+        else:
+            self.templates.invalidate("COMMAND_LONG")
         return success
 
+    def message_frequency_reached(self, message_name: str, frequency: float) -> bool:
+        """
+        Reads back if a mavlink message is received at least at "frequency" Hertz
+        """
+        return self.get_message_frequency(message_name) >= frequency * FREQUENCY_TOLERANCE
+
+    def get_param(self, param_name: str, expected: Optional[float] = None, timeout: float = 1.0) -> Optional[float]:
+        """
+        Requests parameter "param_name" from the autopilot and waits up to "timeout" seconds for its PARAM_VALUE
+        With "expected", waits for that value instead of returning an older PARAM_VALUE.
+        Returns the value, or None if the autopilot did not answer
+        """
+        payload = self.templates.get("PARAM_REQUEST_READ")
+        if payload is None:
+            return None
+        try:
+            for i, char in enumerate(param_name):
+                payload["message"]["param_id"][i] = char
+            payload["message"]["param_index"] = -1
+            # the autopilot read from, as several vehicles can share a mavlink2rest
+            payload["message"]["target_system"] = self.get_vehicle
+            payload["message"]["target_component"] = self.get_component
+        except Exception as error:
+            logger.warning(f"Error requesting parameter '{param_name}': {error}")
+            self.templates.invalidate("PARAM_REQUEST_READ")
+            return None
+        if not self.post("/mavlink", json=payload):
+            self.templates.invalidate("PARAM_REQUEST_READ")
+            return None
+
+        value = None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # the latest PARAM_VALUE of any parameter, e.g. while a ground station loads all of them
+            message = self.get_message("/PARAM_VALUE/message")
+            try:
+                if "".join(message["param_id"]).rstrip("\u0000") == param_name:
+                    value = float(message["param_value"])
+                    if expected is None or value == expected:
+                        return value
+            except Exception:
+                pass
+            time.sleep(PARAM_POLL_INTERVAL)
+        return value
+
+    def ensure_param(self, param_name: str, param_type: str, param_value: float) -> bool:
+        """
+        Sets parameter "param_name" in the autopilot, unless it already has the value
+        Returns True if the autopilot confirmed the value, False otherwise
+        """
+        if self.get_param(param_name) == param_value:
+            logger.info(f"Parameter {param_name} already is {param_value}")
+            return True
+        return (self.set_param(param_name, param_type, param_value)
+                and self.get_param(param_name, expected=param_value) == param_value)
+
     def set_param(self, param_name, param_type, param_value):
         """
         Sets parameter "param_name" of type param_type to value "value" in the autpilot
         Returns True if succesful, False otherwise
         """
-        payload = self.get("/helper/mavlink?name=PARAM_SET")
+        payload = self.templates.get("PARAM_SET")
         if payload is None:
             return False
         try:
@@ -143,10 +422,14 @@ class Mavlink2RestBase:
 
             payload["message"]["param_type"] = {"type": param_type}
             payload["message"]["param_value"] = param_value
+            payload["message"]["target_system"] = self.get_vehicle
+            payload["message"]["target_component"] = self.get_component
 
             success = self.post("/mavlink", json=payload)
             if success:
                 logger.info(f"Successfully set parameter {param_name} to {param_value}")
+            else:
+                self.templates.invalidate("PARAM_SET")
             return success
         except Exception as error:
             logger.warning(f"Error setting parameter '{param_name}': {error}")
@@ -154,42 +437,85 @@ class Mavlink2RestBase:
 
 
 class Mavlink2RestHelper(Mavlink2RestBase):
-    def get_depth(self):
-        return -self.get_float('/VFR_HUD/message/alt')
+    @staticmethod
+    def get_depth(vfr_hud: Optional[MessageSnapshot]) -> float:
+        return -vfr_hud.get_float('alt') if vfr_hud else float("nan")
 
-    def get_orientation(self):
-        return self.get_float('/VFR_HUD/message/heading')
+    @staticmethod
+    def get_orientation(vfr_hud: Optional[MessageSnapshot]) -> float:
+        return vfr_hud.get_float('heading') if vfr_hud else float("nan")
 
-    def get_temperature(self):
-        return self.get_float('/SCALED_PRESSURE2/message/temperature')/100.0
+    @staticmethod
+    def get_temperature(scaled_pressure2: Optional[MessageSnapshot]) -> float:
+        return scaled_pressure2.get_float('temperature')/100.0 if scaled_pressure2 else float("nan")
 
-    def send_gps_input(self, in_json: object, gps_id: int = 0):
+    def send_gps_input(self, in_json: object, gps_id: int = 0) -> bool:
         """
         Forwards the locator(ROV) position to mavproxy's GPSInput module
+        Optional fields of in_json: 'vn', 've' (m/s), 'horiz_accuracy' (m), 'speed_accuracy' (m/s),
+        'fix_time' (UNIX time the position was measured at)
+        Sent over mavlink2rest, or directly as MAVLink frame if a UDP connection is configured.
+        Returns if the message was sent successfully
         """
-        out_json = self.get("/helper/mavlink?name=GPS_INPUT")
-
+        message = {}
         try:
-            out_json["header"]["system_id"] = self.vehicle
-            out_json["header"]["component_id"] = self.component
-            out_json["message"]["gps_id"] = gps_id
-            out_json["message"]['lat'] = math.floor(in_json['lat'] * 1e7)
-            out_json["message"]['lon'] = math.floor(in_json['lon'] * 1e7)
+            message["gps_id"] = gps_id
+            # time of the fix, so the autopilot can account for its age
+            if 'fix_time' in in_json:
+                message['time_usec'] = int(in_json['fix_time'] * 1e6)
+                message['time_week'], message['time_week_ms'] = gps_week_time(in_json['fix_time'])
+            message['lat'] = math.floor(in_json['lat'] * 1e7)
+            message['lon'] = math.floor(in_json['lon'] * 1e7)
             # fix_quality of demo.waterlinked.com is 1
-            out_json["message"]['fix_type'] = 0 if in_json['fix_quality'] == 0 else 3
-            out_json["message"]['hdop'] = 65535.0 if in_json['hdop'] == -1 else in_json['hdop']
-            out_json["message"]['vdop'] = 65535.0
-            out_json["message"]['satellites_visible'] = max(in_json['numsats'], 0)
+            message['fix_type'] = 0 if in_json['fix_quality'] == 0 else 3
+            message['hdop'] = 65535.0 if in_json['hdop'] == -1 else in_json['hdop']
+            message['vdop'] = 65535.0
+            message['satellites_visible'] = max(in_json['numsats'], 0)
             # GPS orientation is forwarded from the received heading /VFR_HUD/message/heading
             if in_json['orientation'] == -1:
-                out_json["message"]['yaw'] = 0  # invalid
+                message['yaw'] = 0  # invalid
             elif in_json['orientation'] == 0:
-                out_json["message"]['yaw'] = 36000  # remap 0 -> 360
+                message['yaw'] = 36000  # remap 0 -> 360
             else:
-                out_json["message"]['yaw'] = math.floor(in_json['orientation'] * 100)  # default
-            out_json["message"]['ignore_flags']['bits'] = 1 | 4 | 8 | 16 | 32 | 64 | 128
+                message['yaw'] = math.floor(in_json['orientation'] * 100)  # default
+            ignore_flags = (GPS_INPUT_IGNORE_FLAG_ALT | GPS_INPUT_IGNORE_FLAG_VDOP | GPS_INPUT_IGNORE_FLAG_VEL_HORIZ
+                            | GPS_INPUT_IGNORE_FLAG_VEL_VERT | GPS_INPUT_IGNORE_FLAG_SPEED_ACCURACY
+                            | GPS_INPUT_IGNORE_FLAG_HORIZONTAL_ACCURACY | GPS_INPUT_IGNORE_FLAG_VERTICAL_ACCURACY)
+            # velocity and accuracies are only known with the position filter
+            if 'vn' in in_json and 've' in in_json:
+                message['vn'] = in_json['vn']
+                message['ve'] = in_json['ve']
+                ignore_flags &= ~GPS_INPUT_IGNORE_FLAG_VEL_HORIZ
+            if 'horiz_accuracy' in in_json:
+                message['horiz_accuracy'] = in_json['horiz_accuracy']
+                ignore_flags &= ~GPS_INPUT_IGNORE_FLAG_HORIZONTAL_ACCURACY
+            if 'speed_accuracy' in in_json:
+                message['speed_accuracy'] = in_json['speed_accuracy']
+                ignore_flags &= ~GPS_INPUT_IGNORE_FLAG_SPEED_ACCURACY
+            message['ignore_flags'] = ignore_flags
         except Exception as e:
             logger.error(f"Parsing locator position not successfull. {e}")
-            return
+            return False
+
+        if self.udp is not None:
+            return self.udp.send_gps_input(message)
 
-        self.post("/mavlink", out_json)
+        out_json = self.templates.get("GPS_INPUT")
+        if out_json is None:
+            # mavlink2rest unreachable, already reported by the circuit breaker
+            return False
+        try:
+            out_json["header"]["system_id"] = self.vehicle
+            out_json["header"]["component_id"] = self.component
+            message['ignore_flags'] = {"bits": ignore_flags}
+            out_json["message"].update(message)
+        except Exception as e:
+            logger.error(f"GPS_INPUT template not as expected. {e}")
+            # the template may not match the expected schema, fetch it again next time
+            self.templates.invalidate("GPS_INPUT")
+            return False
+
+        success = self.post("/mavlink", out_json)
+        if not success:
+            self.templates.invalidate("GPS_INPUT")
+        return success
@@ -0,0 +1,139 @@
+import socket
+import struct
+import time
+from typing import Sequence, Tuple
+
+from loguru import logger
+
+from metrics import UDP_ERRORS, UDP_SEND_SECONDS
+
+MAVLINK_V2_STX = 0xFD
+# STX, payload length, incompatibility flags, compatibility flags, sequence, system id, component id, message id
+HEADER = struct.Struct("<BBBBBBBHB")
+HEADER_SIZE = HEADER.size
+CHECKSUM_SIZE = 2
+
+
+def _crc_table() -> Tuple[int, ...]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+# CRC-16/MCRF4XX (X.25) used by MAVLink, one table lookup per byte
+CRC_TABLE = _crc_table()
+
+
+def x25_crc(data, crc: int = 0xFFFF) -> int:
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc_extra(name: str, fields: Sequence[Tuple[str, str]]) -> int:
+    """
+    Returns the CRC_EXTRA of a message from its name and (type, name) fields in wire order, without extensions
+    It changes with any change of the message definition, receivers drop frames with a different one.
+    """
+    crc = x25_crc(f"{name} ".encode())
+    for field_type, field_name in fields:
+        crc = x25_crc(f"{field_type} {field_name} ".encode(), crc)
+    return (crc & 0xFF) ^ (crc >> 8)
+
+
+class MavlinkMessage:
+    """
+    Layout of a MAVLink message: id, payload struct in wire order (fields sorted by size) and CRC_EXTRA
+    """
+
+    def __init__(self, name: str, message_id: int, fields: Sequence[Tuple[str, str]], extension_format: str = ""):
+        formats = {"uint64_t": "Q", "int64_t": "q", "uint32_t": "I", "int32_t": "i", "float": "f",
+                   "uint16_t": "H", "int16_t": "h", "uint8_t": "B", "int8_t": "b"}
+        self.name = name
+        self.id = message_id
+        self.payload = struct.Struct("<" + "".join(formats[field_type] for field_type, _ in fields) + extension_format)
+        self.crc_extra = crc_extra(name, fields)
+
+
+GPS_INPUT = MavlinkMessage("GPS_INPUT", 232, (
+    ("uint64_t", "time_usec"), ("uint32_t", "time_week_ms"), ("int32_t", "lat"), ("int32_t", "lon"),
+    ("float", "alt"), ("float", "hdop"), ("float", "vdop"), ("float", "vn"), ("float", "ve"), ("float", "vd"),
+    ("float", "speed_accuracy"), ("float", "horiz_accuracy"), ("float", "vert_accuracy"),
+    ("uint16_t", "ignore_flags"), ("uint16_t", "time_week"), ("uint8_t", "gps_id"), ("uint8_t", "fix_type"),
+    ("uint8_t", "satellites_visible"),
+), extension_format="H")  # yaw
+
+
+class MavlinkUdpConnection:
+    """
+    Sends MAVLink v2 messages as binary frames over UDP, e.g. to an endpoint of the BlueOS MAVLink router
+
+    Frames are packed into one reused buffer with precompiled structs, skipping the JSON round trip
+    through mavlink2rest.
+
+    Exception handling: All exceptions are caught and reported over logging.
+    """
+
+    def __init__(self, address: str, system_id: int = 1, component_id: int = 220):
+        host, _, port = address.rpartition(":")
+        self.address = (host, int(port))
+        self.destination = address
+        self.system_id = system_id
+        self.component_id = component_id
+        self.sequence = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        # large enough for any message
+        self.buffer = bytearray(HEADER_SIZE + 255 + CHECKSUM_SIZE)
+
+    def encode(self, message: MavlinkMessage, values: Sequence) -> memoryview:
+        """
+        Returns the frame of a message, valid until the next call
+        """
+        buffer = self.buffer
+        message.payload.pack_into(buffer, HEADER_SIZE, *values)
+        # MAVLink v2 drops trailing zero bytes of the payload, at least one byte is kept
+        length = message.payload.size
+        while length > 1 and buffer[HEADER_SIZE + length - 1] == 0:
+            length -= 1
+        HEADER.pack_into(buffer, 0, MAVLINK_V2_STX, length, 0, 0, self.sequence, self.system_id, self.component_id,
+                         message.id & 0xFFFF, message.id >> 16)
+        self.sequence = (self.sequence + 1) & 0xFF
+        end = HEADER_SIZE + length
+        crc = x25_crc(memoryview(buffer)[1:end])
+        crc = x25_crc((message.crc_extra,), crc)
+        buffer[end] = crc & 0xFF
+        buffer[end + 1] = crc >> 8
+        return memoryview(buffer)[:end + CHECKSUM_SIZE]
+
+    def send(self, message: MavlinkMessage, values: Sequence) -> bool:
+        """
+        Returns if the message was sent successfully
+        """
+        start = time.monotonic()
+        try:
+            self.socket.sendto(self.encode(message, values), self.address)
+            return True
+        except Exception as e:
+            UDP_ERRORS.inc(destination=self.destination)
+            logger.error(f"Got exception: {e}")
+            return False
+        finally:
+            UDP_SEND_SECONDS.observe(time.monotonic() - start, destination=self.destination)
+
+    def send_gps_input(self, fields: dict) -> bool:
+        """
+        Sends GPS_INPUT, fields as in the message definition, missing ones are 0
+        """
+        get = fields.get
+        return self.send(GPS_INPUT, (
+            get('time_usec', 0), get('time_week_ms', 0), fields['lat'], fields['lon'], get('alt', 0.0),
+            get('hdop', 0.0), get('vdop', 0.0), get('vn', 0.0), get('ve', 0.0), get('vd', 0.0),
+            get('speed_accuracy', 0.0), get('horiz_accuracy', 0.0), get('vert_accuracy', 0.0),
+            fields['ignore_flags'], get('time_week', 0), get('gps_id', 0), fields['fix_type'],
+            get('satellites_visible', 0), get('yaw', 0)))
@@ -0,0 +1,152 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond local requests up to timeouts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# (labels, value) samples of a metric
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{key}="{escape_label(value)}"' for key, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """
+    Monotonically increasing count, per set of label values
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(dict(zip(self.label_names, key)))} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets, per set of label values
+    Memory use is constant, no matter how many values are observed.
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts (last one is +Inf), sum]
+        self.values: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collects all metrics of the extension and renders them in the Prometheus text format
+
+    Besides metrics updated in place, collectors can be registered that report values
+    kept elsewhere (e.g. scheduler statistics) at the time of rendering.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        # (name, type, help, function returning the samples)
+        self.collectors: List[Tuple[str, str, str, Callable[[], Samples]]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, type: str, help: str, collect: Callable[[], Samples]) -> None:
+        self.collectors.append((name, type, help, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, type, help, collect in self.collectors:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in collect():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "ugps_http_request_duration_seconds", "Duration of HTTP requests to UGPS and mavlink2rest",
+    ("host", "method", "path"))
+HTTP_ERRORS = REGISTRY.counter(
+    "ugps_http_errors_total", "Failed HTTP requests, by kind (timeout, connection, http, circuit_open, other)",
+    ("host", "method", "path", "kind"))
+UDP_SEND_SECONDS = REGISTRY.histogram(
+    "ugps_udp_send_duration_seconds", "Duration of sending NMEA sentences over UDP", ("destination",))
+UDP_ERRORS = REGISTRY.counter(
+    "ugps_udp_errors_total", "Failed NMEA sends over UDP", ("destination",))
+NMEA_DROPPED = REGISTRY.counter(
+    "ugps_nmea_dropped_total",
+    "Topside positions not delivered to a NMEA destination as it could not take them without blocking",
+    ("destination",))
+STALE_TELEMETRY = REGISTRY.counter(
+    "ugps_stale_telemetry_total", "Reads of a mavlink message refused as it was older than the maximum age",
+    ("message",))
+FIX_TO_AUTOPILOT_SECONDS = REGISTRY.histogram(
+    "ugps_fix_to_autopilot_seconds",
+    "Age of a locator fix when sent to the autopilot, from its measurement time (UGPS timestamp, "
+    "otherwise when it was first polled)")
+JOB_JITTER_SECONDS = REGISTRY.histogram(
+    "ugps_job_start_jitter_seconds", "Delay between a job being due and it being started", ("job",))
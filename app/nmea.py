@@ -0,0 +1,116 @@
+from datetime import datetime
+from typing import List
+
+
+def nmea_checksum(data: bytes) -> int:
+    """
+    Calculates the NMEA checksum (xor of all bytes) of the data between '$' and '*'
+    Folds the data as one integer instead of iterating byte by byte.
+    """
+    value = int.from_bytes(data, "little")
+    size = len(data)
+    while size > 1:
+        half = (size + 1) // 2
+        value = (value & ((1 << (half * 8)) - 1)) ^ (value >> (half * 8))
+        size = half
+    return value
+
+
+class NmeaEncoder:
+    """
+    Encodes a position as a burst of GGA, RMC and VTG sentences
+    NMEA Format: https://gpsd.gitlab.io/gpsd/NMEA.html
+
+    The sentence formats are prepared once, the timestamp is formatted once per burst and all
+    sentences are written into one reusable buffer, which can be sent as a whole or per sentence.
+    """
+
+    GGA = (b"GPGGA,"
+           b"%s,"             # UTC Time (hhmmss.ss)
+           b"%s,%c,"          # Latitude (ddmm.mmm) and direction (N/S)
+           b"%s,%c,"          # Longitude (dddmm.mmm) and direction (E/W)
+           b"%d,"             # Fix? (0-5)
+           b"%02d,"           # Number of Satellites
+           b"%.2f,"           # HDOP
+           b"0,M,"            # MSL altitude and unit (Meters)
+           b"0,M,"            # Geoid separation and unit (Meters)
+           b"00,"             # Age of differential GPS data, N/A
+           b"0000")           # Differential reference station ID, N/A
+
+    RMC = (b"GPRMC,"
+           b"%s,"             # UTC Time (hhmmss.ss)
+           b"A,"              # Status A=active or V=void
+           b"%s,%c,"          # Latitude (ddmm.mmm) and direction (N/S)
+           b"%s,%c,"          # Longitude (dddmm.mmm) and direction (E/W)
+           b"%.1f,"           # Speed over the ground in knots
+           b"%.2f,"           # Track angle in degrees
+           b"%s,"             # Date (ddmmyy)
+           b",,"              # Magnetic variation in degrees and direction
+           b"A")              # A=autonomous, D=differential, E=Estimated, N=not valid, S=Simulator
+
+    VTG = (b"GPVTG,"
+           b"%.1f,T,"         # Track made good (degrees true)
+           b",M,"             # Track made good (degrees magnetic)
+           b"%.1f,N,"         # Speed, in knots
+           b"%.1f,K,"         # Speed over ground in kilometers/hour (kph)
+           b"A")              # A=autonomous, D=differential, E=Estimated, N=not valid, S=Simulator
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # (start, end) of each sentence of the last burst in the buffer
+        self.offsets: List[tuple] = []
+
+    def encode(self, in_json: dict, now: datetime) -> bytearray:
+        """
+        Encodes the position in_json at time "now" (UTC) as GGA, RMC and VTG sentences
+        Returns the buffer holding the burst, only valid until the next call
+        """
+        time = b"%02d%02d%02d.%02d" % (now.hour, now.minute, now.second, now.microsecond // 10000)
+        date = b"%02d%02d%02d" % (now.day, now.month, now.year % 100)
+
+        lat = float(in_json['lat'])
+        lon = float(in_json['lon'])
+        latitude = self.format_coordinate(lat, 2)
+        longitude = self.format_coordinate(lon, 3)
+        latdir = ord("N") if lat >= 0 else ord("S")
+        londir = ord("E") if lon >= 0 else ord("W")
+        # speed over ground of the UGPS is in km/h
+        kph = in_json['sog']
+        knots = kph / 1.852
+
+        # fix type of demo.waterlinked.com is 1
+        fix = 0 if in_json['fix_quality'] == 0 else 3
+        satellites = max(in_json['numsats'], 0)
+        hdop = 9.9 if in_json['hdop'] == -1 else in_json['hdop']
+
+        self.buffer.clear()
+        self.offsets.clear()
+        self._append(self.GGA % (time, latitude, latdir, longitude, londir, fix, satellites, hdop))
+        self._append(self.RMC % (time, latitude, latdir, longitude, londir, knots, in_json['orientation'], date))
+        self._append(self.VTG % (in_json['cog'], knots, kph))
+        return self.buffer
+
+    def sentences(self) -> List[memoryview]:
+        """
+        Returns views of the single sentences of the last burst, without copying them
+        """
+        view = memoryview(self.buffer)
+        return [view[start:end] for start, end in self.offsets]
+
+    @staticmethod
+    def format_coordinate(value: float, degree_digits: int) -> bytes:
+        """
+        Formats a coordinate as degrees and minutes, e.g. ddmm.mmm for latitudes
+        """
+        # integer thousandths of minutes, so rounding never yields 60 minutes
+        thousandths = round(abs(value) * 60000)
+        degrees, thousandths = divmod(thousandths, 60000)
+        minutes, thousandths = divmod(thousandths, 1000)
+        return b"%0*d%02d.%03d" % (degree_digits, degrees, minutes, thousandths)
+
+    def _append(self, body: bytes) -> None:
+        start = len(self.buffer)
+        self.buffer += b"$"
+        self.buffer += body
+        self.buffer += b"*%02X\r\n" % nmea_checksum(body)
+        self.offsets.append((start, len(self.buffer)))
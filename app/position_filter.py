@@ -0,0 +1,143 @@
+import math
+from typing import Optional
+
+from loguru import logger
+
+from geo import LocalTangentPlane
+
+KMH_TO_MS = 1 / 3.6
+
+
+class AxisFilter:
+    """
+    Constant velocity Kalman filter along one axis, state is position and velocity
+    Plain scalar arithmetic on the 2x2 covariance, cheap enough to run at high rates on a Pi.
+    """
+
+    def __init__(self, position: float, position_variance: float, velocity_variance: float):
+        self.position = position
+        self.velocity = 0.0
+        # covariance [[pp, pv], [pv, vv]]
+        self.pp = position_variance
+        self.pv = 0.0
+        self.vv = velocity_variance
+
+    def predicted(self, dt: float, acceleration_variance: float):
+        """
+        Returns (position, velocity, pp, pv, vv) propagated by dt seconds, without changing the filter
+        """
+        dt2 = dt * dt
+        pp = self.pp + 2 * dt * self.pv + dt2 * self.vv + acceleration_variance * dt2 * dt2 / 4
+        pv = self.pv + dt * self.vv + acceleration_variance * dt2 * dt / 2
+        vv = self.vv + acceleration_variance * dt2
+        return self.position + self.velocity * dt, self.velocity, pp, pv, vv
+
+    def predict(self, dt: float, acceleration_variance: float) -> None:
+        self.position, self.velocity, self.pp, self.pv, self.vv = self.predicted(dt, acceleration_variance)
+
+    def update_position(self, measurement: float, variance: float) -> None:
+        innovation = measurement - self.position
+        s = self.pp + variance
+        gain_p = self.pp / s
+        gain_v = self.pv / s
+        self.position += gain_p * innovation
+        self.velocity += gain_v * innovation
+        self.pp, self.pv, self.vv = ((1 - gain_p) * self.pp, (1 - gain_p) * self.pv, self.vv - gain_v * self.pv)
+
+    def update_velocity(self, measurement: float, variance: float) -> None:
+        innovation = measurement - self.velocity
+        s = self.vv + variance
+        gain_p = self.pv / s
+        gain_v = self.vv / s
+        self.position += gain_p * innovation
+        self.velocity += gain_v * innovation
+        self.pp, self.pv, self.vv = (self.pp - gain_p * self.pv, (1 - gain_v) * self.pv, (1 - gain_v) * self.vv)
+
+
+class PositionFilter:
+    """
+    Smooths the locator fixes of the UGPS and dead reckons between them
+
+    Fixes (position, speed and course over ground) update a constant velocity Kalman filter in a
+    local north/east frame, which can then be queried for a position, velocity and accuracy at any time,
+    e.g. to publish GPS_INPUT at a higher rate than the UGPS produces fixes.
+    """
+
+    def __init__(self, fix_accuracy: float = 1.0, acceleration_noise: float = 0.5, speed_accuracy: float = 0.3,
+                 max_dead_reckoning: float = 3.0, outlier_sigma: float = 5.0):
+        # horizontal standard deviation in meters of a fix with hdop 1
+        self.fix_accuracy = fix_accuracy
+        # standard deviation in m/s^2 of the unmodeled acceleration of the vehicle
+        self.acceleration_variance = acceleration_noise ** 2
+        # standard deviation in m/s of the UGPS speed over ground
+        self.speed_accuracy = speed_accuracy
+        # seconds without fix after which no estimate is given anymore
+        self.max_dead_reckoning = max_dead_reckoning
+        # fixes further than this many standard deviations from the prediction restart the filter
+        self.outlier_sigma = outlier_sigma
+
+        self.frame: Optional[LocalTangentPlane] = None
+        self.north: Optional[AxisFilter] = None
+        self.east: Optional[AxisFilter] = None
+        self.time = 0.0
+        self.last_fix_time = -math.inf
+
+    def update(self, fix: dict, time: float) -> None:
+        """
+        Adds a new UGPS fix (as returned by /api/v1/position/global) measured at "time" (monotonic seconds)
+        """
+        hdop = fix['hdop'] if fix.get('hdop', -1) > 0 else 1.0
+        position_variance = (hdop * self.fix_accuracy) ** 2
+        velocity_variance = self.speed_accuracy ** 2
+
+        if self.frame is None or time - self.last_fix_time > self.max_dead_reckoning:
+            self._reset(fix, time, position_variance)
+        north, east = self.frame.to_local(fix['lat'], fix['lon'])
+
+        dt = max(time - self.time, 0.0)
+        self.north.predict(dt, self.acceleration_variance)
+        self.east.predict(dt, self.acceleration_variance)
+        self.time = time
+
+        distance = math.hypot(north - self.north.position, east - self.east.position)
+        sigma = math.sqrt(self.north.pp + self.east.pp + 2 * position_variance)
+        if distance > self.outlier_sigma * sigma:
+            logger.warning(f"Locator fix {distance:.1f} m from prediction, restarting position filter")
+            self._reset(fix, time, position_variance)
+            north, east = 0.0, 0.0
+
+        self.north.update_position(north, position_variance)
+        self.east.update_position(east, position_variance)
+        if 'sog' in fix and 'cog' in fix:
+            speed = fix['sog'] * KMH_TO_MS
+            course = math.radians(fix['cog'])
+            self.north.update_velocity(speed * math.cos(course), velocity_variance)
+            self.east.update_velocity(speed * math.sin(course), velocity_variance)
+        self.last_fix_time = time
+
+    def estimate(self, time: float) -> Optional[dict]:
+        """
+        Returns the estimated state at "time" as
+        {"lat", "lon", "vn", "ve" (m/s), "horiz_accuracy", "speed_accuracy" (1 sigma, m and m/s)},
+        or None if there was no recent fix
+        """
+        if self.frame is None or time - self.last_fix_time > self.max_dead_reckoning:
+            return None
+        dt = max(time - self.time, 0.0)
+        north, vn, north_pp, _, north_vv = self.north.predicted(dt, self.acceleration_variance)
+        east, ve, east_pp, _, east_vv = self.east.predicted(dt, self.acceleration_variance)
+        lat, lon = self.frame.to_global(north, east)
+        return {
+            "lat": lat,
+            "lon": lon,
+            "vn": vn,
+            "ve": ve,
+            "horiz_accuracy": math.sqrt(north_pp + east_pp),
+            "speed_accuracy": math.sqrt(north_vv + east_vv),
+        }
+
+    def _reset(self, fix: dict, time: float, position_variance: float) -> None:
+        self.frame = LocalTangentPlane(fix['lat'], fix['lon'])
+        self.north = AxisFilter(0.0, position_variance, self.speed_accuracy ** 2)
+        self.east = AxisFilter(0.0, position_variance, self.speed_accuracy ** 2)
+        self.time = time
@@ -1,129 +1,178 @@
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import socket
+import threading
+import time
 from datetime import datetime, timezone
-from math import floor
-from functools import reduce
-import operator
 from loguru import logger
 
+from metrics import NMEA_DROPPED, UDP_ERRORS, UDP_SEND_SECONDS
+from nmea import NmeaEncoder
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Parses "host:port" into (host, port)
+    """
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+class NmeaTcpServer:
+    """
+    Serves NMEA sentences to any number of TCP clients, e.g. chart plotters (port 10110 by convention)
+
+    Sending never blocks: data a client can not take right away is buffered up to "max_pending" bytes,
+    further bursts are dropped for that client and counted, so a slow client never stalls forwarding.
+
+    Exception handling: All exceptions are caught and reported over logging, failing clients are disconnected.
+    """
+
+    def __init__(self, port: int = 10110, host: str = "0.0.0.0", max_pending: int = 4096):
+        self.port = port
+        self.host = host
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # client socket -> data not sent yet
+        self.clients: Dict[socket.socket, bytearray] = {}
+        self.server: Optional[socket.socket] = None
+
+    def start(self) -> None:
+        try:
+            self.server = socket.create_server((self.host, self.port))
+        except Exception as e:
+            logger.error(f"Could not serve NMEA on TCP port {self.port}: {e}")
+            return
+        threading.Thread(target=self._accept, name="nmea-tcp-server", daemon=True).start()
+        logger.info(f"Serving NMEA on TCP port {self.port}")
+
+    def send(self, data: bytes) -> None:
+        with self.lock:
+            for client, pending in list(self.clients.items()):
+                if len(pending) + len(data) > self.max_pending:
+                    NMEA_DROPPED.inc(destination=self._destination(client))
+                else:
+                    pending += data
+                try:
+                    sent = client.send(pending)
+                    del pending[:sent]
+                except BlockingIOError:
+                    pass
+                except Exception as e:
+                    logger.info(f"NMEA client {self._destination(client)} disconnected: {e}")
+                    del self.clients[client]
+                    client.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, address = self.server.accept()
+                client.setblocking(False)
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except Exception as e:
+                logger.error(f"Accepting NMEA client failed: {e}")
+                time.sleep(1)
+                continue
+            logger.info(f"NMEA client {address[0]}:{address[1]} connected")
+            with self.lock:
+                self.clients[client] = bytearray()
+
+    @staticmethod
+    def _destination(client: socket.socket) -> str:
+        try:
+            return f"tcp:{client.getpeername()[0]}"
+        except OSError:
+            return "tcp:disconnected"
+
 
 class QgcConnection:
     """
     Responsible for interfacing with QGroundControl over UDP
 
+    Each position is encoded once and sent to every destination: unicast UDP (QGC and others),
+    a multicast group, and the clients of an optional TCP server.
+    Sends never block, sentences a destination can not take are dropped and counted.
+
     Exception handling: All exceptions are caught and reported over logging.
     NMEA Format: https://gpsd.gitlab.io/gpsd/NMEA.html
     """
 
-    def __init__(self, ip: str = "192.168.2.1", port: int = 14401):
+    def __init__(self, ip: str = "192.168.2.1", port: int = 14401, single_datagram: bool = False,
+                 destinations: Sequence[str] = (), multicast: str = "", multicast_ttl: int = 1, tcp_port: int = 0):
         # store host
         self.ip = ip
         self.port = port
+        # UDP destinations as (ip, port), QGC first
+        self.destinations: List[Tuple[str, int]] = [(ip, port)] if ip else []
+        self.destinations += [parse_address(destination) for destination in destinations]
 
         # Use UDP port 14401 to send NMEA data to QGC for topside location
         self.nmea_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.nmea_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.nmea_socket.setblocking(0)
+        if multicast:
+            # multicast group, e.g. 239.192.0.1:10110, reaching every listener on the topside network
+            self.nmea_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+            self.destinations.append(parse_address(multicast))
+
+        # optional TCP server, started by start()
+        self.tcp_server = NmeaTcpServer(tcp_port) if tcp_port else None
+
+        # Encodes the topside position into NMEA sentences
+        self.encoder = NmeaEncoder()
+        # send all sentences of a position in one datagram instead of one datagram per sentence
+        self.single_datagram = single_datagram
+
+    @property
+    def enabled(self) -> bool:
+        """
+        If there is any destination to send positions to
+        """
+        return bool(self.destinations) or self.tcp_server is not None
 
-        # Nmea messages templates
-        self.gpgga = ("$GPGGA,"                           # Message ID
-            + "{hours:02d}{minutes:02d}{seconds:02.2f},"  # UTC Time
-            + "{lat:02.0f}{latmin:02.3f},"                # Latitude (degrees + minutes)
-            + "{latdir},"                                 # Latitude direction (N/S)
-            + "{lon:03.0f}{lonmin:02.3f},"                # Longitude (degrees + minutes)
-            + "{londir},"                                 # Longitude direction (W/E)
-            + "{fix},"                                    # Fix? (0-5)
-            + "{satellites:02d},"                         # Number of Satellites
-            + "{hdop:01.2f},"                             # HDOP
-            + "0,"                                        # MSL altitude
-            + "M,"                                        # MSL altitude unit (Meters)
-            + "0,"                                        # Geoid separation
-            + "M,"                                        # Geoid separation unit (Meters)
-            + "00,"                                       # Age of differential GPS data, N/A
-            + "0000"                                      # Age of differential GPS data, N/A
-            + "*")                                        # Checksum
-
-        self.gprmc = ("$GPRMC,"                           # Message ID
-            + "{hours:02d}{minutes:02d}{seconds:02.2f},"  # UTC Time
-            + "A,"                                        # Status A=active or V=void
-            + "{lat:02.0f}{latmin:02.3f},"                # Latitude (degrees + minutes)
-            + "{latdir},"                                 # Latitude direction (N/S)
-            + "{lon:03.0f}{lonmin:02.3f},"                # Longitude (degrees + minutes)
-            + "{londir},"                                 # Longitude direction (W/E)
-            + "{knots:01.1f},"                            # Speed over the ground in knots
-            + "{orientation:03.2f},"                      # Track angle in degrees
-            + "{date},"                                   # Date
-            + ","                                         # Magnetic variation in degrees
-            + ","                                         # Magnetic variation direction
-            + "A"                                         # A=autonomous, D=differential, E=Estimated, N=not valid, S=Simulator
-            + "*")                                        # Checksum
-
-        self.gpvtg = ("$GPVTG,"                           # Message ID
-            + "{cog:03.1f},"                              # Track made good (degrees true)
-            + "T,"                                        # T: track made good is relative to true north
-            + ","                                         # Track made good (degrees magnetic)
-            + "M,"                                        # M: track made good is relative to magnetic north
-            + "{knots:02.1f},"                            # Speed, in knots
-            + "N,"                                        # N: speed is measured in knots
-            + "{kph:02.1f},"                              # Speed over ground in kilometers/hour (kph)
-            + "K,"                                        # K: speed over ground is measured in kph
-            + "A"                                         # A=autonomous, D=differential, E=Estimated, N=not valid, S=Simulator.
-            + "*")                                        # Checksum
+    def start(self) -> None:
+        if self.tcp_server is not None:
+            self.tcp_server.start()
 
     def send_topside_position(self, in_json: object):
         """
         This sends the topside position and orientation
-        to QGroundControl via UDP port 14401
+        to QGroundControl via UDP port 14401, and every other destination
+        Returns if sending was successful
         """
         try:
-            for message in [self.gpgga, self.gprmc, self.gpvtg]:
-                msg = self.format_nmea(
-                    message,
-                    datetime.now(timezone.utc),
-                    in_json
-                    )
-                logger.debug(f"Sending UDP {msg}")
-                self.nmea_socket.sendto(msg.encode('utf-8'), (self.ip, self.port))
+            # UTC fields are the time of the fix if known, the time of sending otherwise
+            if 'fix_time' in in_json:
+                now = datetime.fromtimestamp(in_json['fix_time'], timezone.utc)
+            else:
+                now = datetime.now(timezone.utc)
+            burst = self.encoder.encode(in_json, now)
         except Exception as e:
             logger.error(f"Got exception: {e}")
+            return False
+        logger.debug("Sending UDP {}", burst)
+        datagrams = [burst] if self.single_datagram else list(self.encoder.sentences())
+        ok = True
+        for address in self.destinations:
+            ok &= self._send_udp(datagrams, address)
+        if self.tcp_server is not None:
+            self.tcp_server.send(bytes(burst))
+        return ok
 
-    def format_nmea(self, message, now, in_json):
-        """
-        Formats data into nmea message
-        """
-        lat = float(in_json['lat'])
-        lon = float(in_json['lon'])
-        latdir = "N" if lat > 0 else "S"
-        londir = "E" if lon > 0 else "W"
-        lat = abs(lat)
-        lon = abs(lon)
-
-        msg = message.format(date=now.strftime("%d%m%y"),
-                            hours=now.hour,
-                            minutes=now.minute,
-                            seconds=(now.second + now.microsecond/1000000.0),
-                            # fix type of demo.waterlinked.com is 1
-                            fix=0 if in_json['fix_quality'] == 0 else 3,
-                            satellites=max(in_json['numsats'], 0),
-                            hdop= (9.9 if in_json['hdop'] == -1 else in_json['hdop']),
-                            lat=floor(lat),
-                            latmin=(lat % 1) * 60,
-                            latdir=latdir,
-                            lon=floor(lon),
-                            lonmin=(lon % 1) * 60,
-                            londir=londir,
-                            orientation=in_json['orientation'],
-                            knots=in_json['sog']/1.852,
-                            kph=in_json['sog'],
-                            cog=in_json['cog'],)
-        return f"{msg}{self.calculate_nmea_checksum(msg):02x}\r\n"
-
-    def calculate_nmea_checksum(self, string):
-        """
-        Calculates the checksum of an Nmea string
-        """
-        data, _ = string.split("*")
-        bytes = bytearray(data[1:], "utf-8")
-        calculated_checksum = reduce(operator.xor, bytes, 0)
-        return calculated_checksum
+    def _send_udp(self, datagrams: List[Any], address: Tuple[str, int]) -> bool:
+        destination = f"{address[0]}:{address[1]}"
+        start = time.monotonic()
+        try:
+            for datagram in datagrams:
+                self.nmea_socket.sendto(datagram, address)
+            return True
+        except BlockingIOError:
+            # socket buffer full, the rest of this position is dropped instead of waiting
+            NMEA_DROPPED.inc(destination=destination)
+            return True
+        except Exception as e:
+            UDP_ERRORS.inc(destination=destination)
+            logger.error(f"Got exception: {e}")
+            return False
+        finally:
+            UDP_SEND_SECONDS.observe(time.monotonic() - start, destination=destination)
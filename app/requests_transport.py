@@ -0,0 +1,68 @@
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+
+class ReconnectRetry(Retry):
+    """
+    Retries requests that failed on a dropped or refused connection, but not requests that timed out
+    connecting or reading, so that an unresponsive host does not block for the timeout twice
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # raised as requests expects them to translate into ConnectTimeout and ReadTimeout,
+        # urllib3 derives NewConnectionError (e.g. connection refused) from ConnectTimeoutError
+        if isinstance(error, ConnectTimeoutError) and not isinstance(error, NewConnectionError):
+            raise MaxRetryError(_pool, url, error)
+        if isinstance(error, ReadTimeoutError):
+            raise error
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class RequestsTransport:
+    """
+    Sends the requests of HttpClient with a requests.Session, over pooled keep-alive connections
+
+    Exception handling: Exceptions are passed on to the caller, which is responsible for reporting them.
+    """
+
+    timeout_errors = (requests.Timeout,)
+    connection_errors = (requests.ConnectionError,)
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 4, retries: int = 1):
+        # pool_connections: number of hosts to keep pools for, pool_maxsize: connections kept per host
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            # Retry on connection errors and dropped sockets only, never on HTTP status codes.
+            # All methods are retried, as a stale keep-alive socket fails before the request reaches the server.
+            max_retries=ReconnectRetry(total=retries, connect=retries, read=retries, status=0,
+                                       allowed_methods=False, raise_on_status=False),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def send(self, method: str, url: str, timeout, json=None) -> requests.Response:
+        return self.session.request(method, url, timeout=timeout, json=json)
+
+    def connection_stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            # every request on a pool either opened a new connection or reused one
+            stats[host] = {
+                "opened": pool.num_connections,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
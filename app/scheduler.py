@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from metrics import JOB_JITTER_SECONDS
+
+# What to do with ticks that were missed because a job was still running or the loop was late
+SKIP = "skip"          # drop missed ticks and continue at the next tick in the future
+CATCH_UP = "catch_up"  # run missed ticks back to back until the job is on schedule again
+
+
+class Job:
+    """
+    A periodic job of the DeadlineScheduler, including its timing statistics
+    """
+
+    def __init__(self, name: str, rate: float, func: Callable[[], None], policy: str = SKIP,
+                 max_catch_up: int = 10, index: int = 0):
+        self.name = name
+        # order in which jobs were added, jobs due at the same time run in this order
+        self.index = index
+        self.period = 1.0 / rate
+        self.func = func
+        self.policy = policy
+        # upper limit of queued runs with the CATCH_UP policy
+        self.max_catch_up = max_catch_up
+
+        self.due = 0.0
+        # incremented on every reschedule, heap entries of older generations are stale
+        self.generation = 0
+        self.running = False
+        self.pending = 0
+
+        # statistics
+        self.runs = 0
+        self.on_time_runs = 0  # runs started by a tick or trigger, the ones jitter is measured for
+        self.overruns = 0  # ticks that arrived while the previous run was still busy
+        self.dropped = 0   # ticks that were not executed
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "dropped": self.dropped,
+            "last_jitter": self.last_jitter,
+            "max_jitter": self.max_jitter,
+            "mean_jitter": self.total_jitter / self.on_time_runs if self.on_time_runs else 0.0,
+        }
+
+
+class DeadlineScheduler:
+    """
+    Runs periodic jobs at individual rates, sleeping exactly until the next job is due
+
+    Every run of a job is executed in a worker thread as its own task, so a blocking job only delays itself.
+    Jobs can additionally be triggered from any thread (e.g. on new data), which restarts their period.
+
+    clock: monotonic time source, time_scale: how much faster than real time the clock runs (for simulations)
+    advance: for simulations in virtual time, moves the clock forward by the given seconds. Instead of sleeping,
+    the scheduler then advances the clock to the next deadline, and runs jobs one after another in the event loop,
+    so a simulation runs as fast as possible and with the same result every time.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, time_scale: float = 1.0,
+                 advance: Optional[Callable[[float], None]] = None):
+        self.clock = clock
+        self.time_scale = time_scale
+        self.advance = advance
+        self.jobs: Dict[str, Job] = {}
+        self.queue: List[Tuple[float, int, int, str]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        # references to running job tasks, so they are not garbage collected
+        self.tasks = set()
+        self.stopped = False
+
+    def add_job(self, name: str, rate: float, func: Callable[[], None], policy: str = SKIP,
+                delay: float = 0.0) -> Job:
+        """
+        Adds a job that runs "func" at "rate" Hz, first run is due after "delay" seconds, immediately by default
+        """
+        job = Job(name, rate, func, policy, index=len(self.jobs))
+        self.jobs[name] = job
+        self._schedule(job, self.clock() + delay)
+        return job
+
+    def trigger(self, name: str) -> None:
+        """
+        Runs a job as soon as possible, thread safe. Ignored if the scheduler is not running.
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._trigger, name)
+
+    def stop(self) -> None:
+        """
+        Ends run() once the running jobs finished, thread safe
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    async def run(self, until: float = math.inf) -> None:
+        """
+        Runs the jobs until the clock reaches "until" or stop() is called, forever by default
+        """
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        while self.clock() < until and not self.stopped:
+            if not self.queue:
+                await self._sleep(math.inf)
+                continue
+            due, _, generation, name = self.queue[0]
+            now = self.clock()
+            if due > now:
+                await self._sleep(due - now)
+                continue
+            heapq.heappop(self.queue)
+            job = self.jobs[name]
+            if generation != job.generation:
+                continue
+            self._tick(job, now)
+        if self.tasks:
+            await asyncio.wait(set(self.tasks))
+
+    def _tick(self, job: Job, now: float) -> None:
+        if job.running:
+            job.overruns += 1
+            if job.policy == CATCH_UP and job.pending < job.max_catch_up:
+                job.pending += 1
+            else:
+                job.dropped += 1
+        else:
+            self._start(job, now - job.due)
+
+        next_due = job.due + job.period
+        if next_due <= now and job.policy == SKIP:
+            missed = math.floor((now - next_due) / job.period) + 1
+            job.dropped += missed
+            next_due += missed * job.period
+        self._schedule(job, next_due)
+
+    def _trigger(self, name: str) -> None:
+        job = self.jobs.get(name)
+        if job is None or job.running:
+            return
+        now = self.clock()
+        self._start(job, 0.0)
+        self._schedule(job, now + job.period)
+
+    def _stop(self) -> None:
+        self.stopped = True
+        self.wakeup.set()
+
+    def _start(self, job: Job, jitter: float) -> None:
+        job.runs += 1
+        job.on_time_runs += 1
+        job.last_jitter = jitter
+        job.max_jitter = max(job.max_jitter, jitter)
+        job.total_jitter += jitter
+        JOB_JITTER_SECONDS.observe(jitter, job=job.name)
+        job.running = True
+        task = asyncio.create_task(self._execute(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _execute(self, job: Job) -> None:
+        while True:
+            try:
+                if self.advance is None:
+                    await asyncio.to_thread(job.func)
+                else:
+                    # virtual time stands still while a job runs
+                    job.func()
+            except Exception as e:
+                logger.error(f"Job {job.name} failed: {e}")
+            if job.pending == 0:
+                break
+            # missed ticks with the CATCH_UP policy are run back to back
+            job.pending -= 1
+            job.runs += 1
+        job.running = False
+
+    def _schedule(self, job: Job, due: float) -> None:
+        job.due = due
+        job.generation += 1
+        heapq.heappush(self.queue, (due, job.index, job.generation, job.name))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _sleep(self, delay: float) -> None:
+        """
+        Sleeps for "delay" clock seconds, or until a job is (re)scheduled
+        In virtual time running jobs are finished first, then the clock jumps forward.
+        """
+        if self.advance is not None:
+            if self.tasks:
+                await asyncio.wait(set(self.tasks))
+            else:
+                self.advance(delay)
+            return
+        self.wakeup.clear()
+        timeout = None if math.isinf(delay) else delay / self.time_scale
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,414 @@
+"""
+Runs UgpsExtension against in-process stand-ins of UGPS, mavlink2rest and QGC
+
+The stand-ins answer the same requests as the real APIs from a scenario: a synthetic lawnmower survey with
+drift and acoustic dropouts, or the replay of a flight recording. Time is simulated, either N times faster
+than real time or, by default, in virtual time which jumps from deadline to deadline, so hours of dive time
+take seconds and every run with the same arguments produces the same output.
+"""
+
+import bisect
+import json
+import math
+import random
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+from flight_recorder import DEPTH, LOCATOR, ORIENTATION, TOPSIDE, read_records
+from geo import LocalTangentPlane
+from mavlink2resthelper import Mavlink2RestHelper
+from position_filter import KMH_TO_MS
+from qgc_connection import QgcConnection
+from scheduler import DeadlineScheduler
+from ugps_connection import UgpsConnection
+
+# start of synthetic scenarios (2024-01-01 UTC), fixed so their output does not depend on when they run
+SYNTHETIC_EPOCH = 1704067200.0
+
+# message templates as served by mavlink2rest's /helper/mavlink, also used by the benchmark servers
+TEMPLATES = {
+    "GPS_INPUT": {"time_usec": 0, "gps_id": 0, "ignore_flags": {"bits": 0}, "time_week_ms": 0, "time_week": 0,
+                  "fix_type": 0, "lat": 0, "lon": 0, "alt": 0.0, "hdop": 0.0, "vdop": 0.0, "vn": 0.0, "ve": 0.0,
+                  "vd": 0.0, "speed_accuracy": 0.0, "horiz_accuracy": 0.0, "vert_accuracy": 0.0,
+                  "satellites_visible": 0, "yaw": 0},
+    "COMMAND_LONG": {"target_system": 0, "target_component": 0, "command": {"type": "MAV_CMD_NAV_WAYPOINT"},
+                     "confirmation": 0, "param1": 0.0, "param2": 0.0, "param3": 0.0, "param4": 0.0,
+                     "param5": 0.0, "param6": 0.0, "param7": 0.0},
+    "PARAM_SET": {"target_system": 0, "target_component": 0, "param_id": ["\u0000"] * 16, "param_value": 0.0,
+                  "param_type": {"type": "MAV_PARAM_TYPE_UINT8"}},
+    "PARAM_REQUEST_READ": {"target_system": 0, "target_component": 0, "param_id": ["\u0000"] * 16,
+                           "param_index": -1},
+}
+
+
+class SimulationClock:
+    """
+    Simulated time, starting at 0 (monotonic) and "epoch" (UNIX time)
+
+    Runs "time_scale" times faster than real time, or in virtual time if time_scale is 0,
+    where it only moves when advanced by the scheduler.
+    """
+
+    def __init__(self, time_scale: float = 0.0, epoch: float = SYNTHETIC_EPOCH):
+        self.time_scale = time_scale
+        self.epoch = epoch
+        self.now = 0.0
+        self.real_start = time.monotonic()
+
+    @property
+    def virtual(self) -> bool:
+        return self.time_scale == 0
+
+    def monotonic(self) -> float:
+        if self.virtual:
+            return self.now
+        return (time.monotonic() - self.real_start) * self.time_scale
+
+    def time(self) -> float:
+        return self.epoch + self.monotonic()
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SimulationOutput:
+    """
+    Everything the extension sent during a simulation, as (simulated UNIX time, destination, data)
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[float, str, object]] = []
+        # horizontal distance in meters of every GPS_INPUT from the true position, if the scenario knows it
+        self.position_errors: List[float] = []
+
+    def add(self, timestamp: float, destination: str, data: object) -> None:
+        self.events.append((timestamp, destination, data))
+
+    def count(self, destination: str) -> int:
+        return sum(1 for _, event_destination, _ in self.events if event_destination == destination)
+
+    def write(self, path: str) -> None:
+        """
+        Writes the events as JSON lines, e.g. to compare the output of two versions with diff
+        """
+        with open(path, "w") as file:
+            for timestamp, destination, data in sorted(self.events, key=lambda event: (event[0], event[1])):
+                file.write(json.dumps({"time": round(timestamp, 6), "destination": destination, "data": data}) + "\n")
+
+
+class LawnmowerScenario:
+    """
+    Synthetic survey: the vehicle drives parallel north/south legs, drifting with the current
+
+    The UGPS produces noisy fixes at "fix_rate", and loses the acoustic link for "dropout_duration" long
+    periods, "dropout_rate" of the time. During a dropout it keeps reporting the last fix.
+    Depth and temperature vary slowly. Random values are derived from the seed and the fix number,
+    so they do not depend on how often or in which order the stand-ins are queried.
+    """
+
+    def __init__(self, lat: float = 63.422065, lon: float = 10.434353, speed: float = 1.0,
+                 leg_length: float = 50.0, leg_spacing: float = 10.0, drift: Tuple[float, float] = (0.05, 0.02),
+                 fix_rate: float = 2.0, fix_noise: float = 0.5, dropout_rate: float = 0.1,
+                 dropout_duration: float = 10.0, seed: int = 0):
+        self.frame = LocalTangentPlane(lat, lon)
+        self.speed = speed
+        self.leg_length = leg_length
+        self.leg_spacing = leg_spacing
+        # current in m/s (north, east)
+        self.drift = drift
+        self.fix_rate = fix_rate
+        # standard deviation of the fix position in meters
+        self.fix_noise = fix_noise
+        self.dropout_rate = dropout_rate
+        self.dropout_duration = dropout_duration
+        self.seed = seed
+        self.epoch = SYNTHETIC_EPOCH
+        # synthetic scenarios have no end
+        self.duration = None
+
+    def state(self, t: float) -> Tuple[float, float, float, float]:
+        """
+        Returns the true (north, east, velocity north, velocity east) at "t" seconds, in m and m/s
+        """
+        distance = self.speed * t
+        cycle = self.leg_length + self.leg_spacing
+        leg, along = divmod(distance, cycle)
+        leg = int(leg)
+        forward = leg % 2 == 0
+        if along < self.leg_length:
+            north = along if forward else self.leg_length - along
+            east = leg * self.leg_spacing
+            vn, ve = (self.speed if forward else -self.speed), 0.0
+        else:
+            north = self.leg_length if forward else 0.0
+            east = leg * self.leg_spacing + along - self.leg_length
+            vn, ve = 0.0, self.speed
+        return (north + self.drift[0] * t, east + self.drift[1] * t, vn + self.drift[0], ve + self.drift[1])
+
+    def truth(self, t: float) -> Optional[Tuple[float, float]]:
+        north, east, _, _ = self.state(t)
+        return self.frame.to_global(north, east)
+
+    def vehicle(self, t: float) -> Tuple[float, float, float]:
+        """
+        Returns (depth in m, temperature in degrees Celsius, heading in degrees) at "t" seconds
+        """
+        _, _, vn, ve = self.state(t)
+        heading = math.degrees(math.atan2(ve, vn)) % 360
+        return 5.0 + 2.0 * math.sin(2 * math.pi * t / 120), 12.0 + 0.5 * math.sin(2 * math.pi * t / 3600), heading
+
+    def dropped(self, fix: int) -> bool:
+        """
+        Returns if a fix falls into a period where the acoustic link is lost
+        """
+        period = math.floor(fix / self.fix_rate / self.dropout_duration)
+        return random.Random(f"{self.seed}-dropout-{period}").random() < self.dropout_rate
+
+    def locator(self, t: float) -> Optional[dict]:
+        fix = math.floor(t * self.fix_rate)
+        # during dropouts the UGPS keeps reporting the last fix before them
+        while fix >= 0 and self.dropped(fix):
+            period = math.floor(fix / self.fix_rate / self.dropout_duration)
+            fix = math.ceil(period * self.dropout_duration * self.fix_rate) - 1
+        if fix < 0:
+            return None
+        fix_time = fix / self.fix_rate
+        north, east, vn, ve = self.state(fix_time)
+        noise = random.Random(f"{self.seed}-fix-{fix}")
+        lat, lon = self.frame.to_global(north + noise.gauss(0, self.fix_noise), east + noise.gauss(0, self.fix_noise))
+        _, _, heading = self.vehicle(fix_time)
+        return {"lat": lat, "lon": lon, "orientation": heading, "cog": math.degrees(math.atan2(ve, vn)) % 360,
+                "sog": math.hypot(vn, ve) / KMH_TO_MS, "fix_quality": 1, "hdop": 1.0, "numsats": 0,
+                "timestamp": fix_time}
+
+    def topside(self, t: float) -> dict:
+        return {"lat": self.frame.lat, "lon": self.frame.lon, "orientation": 90.0, "cog": 0.0, "sog": 0.0,
+                "fix_quality": 1, "hdop": 0.8, "numsats": 9, "timestamp": t}
+
+
+class TraceScenario:
+    """
+    Replays a flight recording: the stand-ins report the recorded fixes, depth, temperature and heading
+    at the times they were recorded
+    """
+
+    def __init__(self, path: str):
+        # kind -> sorted times (seconds since the start of the recording) and values at those times
+        self.times = {DEPTH: [], ORIENTATION: [], LOCATOR: [], TOPSIDE: []}
+        self.values = {DEPTH: [], ORIENTATION: [], LOCATOR: [], TOPSIDE: []}
+        records = list(read_records(path))
+        if not records:
+            raise ValueError(f"Flight recording {path} is empty")
+        self.epoch = records[0].time
+        self.duration = records[-1].time - self.epoch
+        for record in records:
+            if record.kind not in self.times:
+                continue
+            # fixes are replayed at the time they were measured
+            age = record.latency if record.kind in (LOCATOR, TOPSIDE) and not math.isnan(record.latency) else 0.0
+            t = record.time - age - self.epoch
+            index = bisect.bisect_right(self.times[record.kind], t)
+            self.times[record.kind].insert(index, t)
+            self.values[record.kind].insert(index, record.values)
+
+    def latest(self, kind: int, t: float) -> int:
+        """
+        Returns the index of the latest record of a kind at "t" seconds, -1 if there is none yet
+        """
+        return bisect.bisect_right(self.times[kind], t) - 1
+
+    def truth(self, t: float) -> Optional[Tuple[float, float]]:
+        return None
+
+    def vehicle(self, t: float) -> Tuple[float, float, float]:
+        depth = self.latest(DEPTH, t)
+        orientation = self.latest(ORIENTATION, t)
+        depth, temperature = self.values[DEPTH][depth][:2] if depth >= 0 else (math.nan, math.nan)
+        return depth, temperature, self.values[ORIENTATION][orientation][0] if orientation >= 0 else math.nan
+
+    def locator(self, t: float) -> Optional[dict]:
+        index = self.latest(LOCATOR, t)
+        if index < 0:
+            return None
+        fix_time = self.times[LOCATOR][index]
+        lat, lon, hdop, fix_quality = self.values[LOCATOR][index]
+        _, _, heading = self.vehicle(t)
+        position = {"lat": lat, "lon": lon, "orientation": 0.0 if math.isnan(heading) else heading,
+                    "fix_quality": 1 if math.isnan(fix_quality) else int(fix_quality),
+                    "hdop": -1 if math.isnan(hdop) else hdop, "numsats": 0, "timestamp": fix_time}
+        # speed and course over ground are not recorded, they follow from consecutive fixes
+        if index > 0 and fix_time > self.times[LOCATOR][index - 1]:
+            previous_lat, previous_lon = self.values[LOCATOR][index - 1][:2]
+            north, east = LocalTangentPlane(previous_lat, previous_lon).to_local(lat, lon)
+            speed = math.hypot(north, east) / (fix_time - self.times[LOCATOR][index - 1])
+            position["sog"] = speed / KMH_TO_MS
+            position["cog"] = math.degrees(math.atan2(east, north)) % 360
+        return position
+
+    def topside(self, t: float) -> Optional[dict]:
+        index = self.latest(TOPSIDE, t)
+        if index < 0:
+            return None
+        lat, lon, hdop, orientation = self.values[TOPSIDE][index]
+        return {"lat": lat, "lon": lon, "orientation": orientation, "cog": 0.0, "sog": 0.0, "fix_quality": 1,
+                "hdop": -1 if math.isnan(hdop) else hdop, "numsats": 0, "timestamp": self.times[TOPSIDE][index]}
+
+
+class SimulatedUgps(UgpsConnection):
+    """
+    UGPS topside answering from a scenario instead of over HTTP
+    """
+
+    def __init__(self, scenario, clock: SimulationClock, output: SimulationOutput):
+        super().__init__(host="simulated")
+        self.scenario = scenario
+        self.clock = clock
+        self.output = output
+
+    def get(self, path: str):
+        t = self.clock.monotonic()
+        if path == "/api/v1/position/global":
+            position = self.scenario.locator(t)
+        elif path == "/api/v1/position/master":
+            position = self.scenario.topside(t)
+        elif path == "/api/v1/position/acoustic/filtered":
+            position = self.relative_position(t)
+        elif path == "/api/v1/about/":
+            return {"product_name": "simulated"}
+        else:
+            return None
+        if position is not None:
+            position["timestamp"] += self.clock.epoch
+        return position
+
+    def relative_position(self, t: float) -> Optional[dict]:
+        """
+        The locator position relative to the topside, x forward along its heading and y to starboard
+        """
+        locator, topside = self.scenario.locator(t), self.scenario.topside(t)
+        if locator is None or topside is None:
+            return None
+        north, east = LocalTangentPlane(topside["lat"], topside["lon"]).to_local(locator["lat"], locator["lon"])
+        heading = math.radians(topside["orientation"])
+        return {"x": north * math.cos(heading) + east * math.sin(heading),
+                "y": east * math.cos(heading) - north * math.sin(heading),
+                "std": locator["hdop"], "position_valid": locator["fix_quality"] != 0,
+                "timestamp": locator["timestamp"]}
+
+    def put(self, path: str, json: object) -> bool:
+        self.output.add(self.clock.time(), "ugps" + path, json)
+        return True
+
+    def wait_for_connection(self, stop=None) -> bool:
+        return True
+
+
+class SimulatedMavlink2Rest(Mavlink2RestHelper):
+    """
+    mavlink2rest and the autopilot, answering from a scenario instead of over HTTP
+    """
+
+    def __init__(self, scenario, clock: SimulationClock, output: SimulationOutput):
+        super().__init__(host="simulated", vehicle=1, component=220, get_vehicle=1, get_component=1, clock=clock)
+        self.scenario = scenario
+        self.clock = clock
+        self.output = output
+
+    def get(self, path: str):
+        if path.startswith("/helper/mavlink?name="):
+            name = path.split("=", 1)[1]
+            if name not in TEMPLATES:
+                return None
+            message = dict(TEMPLATES[name], type=name)
+            return {"header": {"system_id": 255, "component_id": 0, "sequence": 0}, "message": message}
+        depth, temperature, heading = self.scenario.vehicle(self.clock.monotonic())
+        messages = {
+            "VFR_HUD": {"type": "VFR_HUD", "alt": -depth, "heading": heading},
+            "SCALED_PRESSURE2": {"type": "SCALED_PRESSURE2", "temperature": temperature * 100},
+        }
+        name = path.rpartition("/")[2]
+        if path != f"/mavlink/vehicles/1/components/1/messages/{name}" or name not in messages:
+            return None
+        # the autopilot streams continuously, so every message was just received
+        received = datetime.fromtimestamp(self.clock.time(), timezone.utc).isoformat()
+        return {"message": messages[name],
+                "message_information": {"time": {"first_message": received, "last_message": received}}}
+
+    def post(self, path: str, json: object) -> bool:
+        message = json["message"]
+        timestamp = self.clock.time()
+        self.output.add(timestamp, "mavlink/" + message["type"], message)
+        if message["type"] == "GPS_INPUT":
+            truth = self.scenario.truth(timestamp - self.clock.epoch)
+            if truth is not None:
+                north, east = LocalTangentPlane(*truth).to_local(message["lat"] / 1e7, message["lon"] / 1e7)
+                self.output.position_errors.append(math.hypot(north, east))
+        return True
+
+
+class CapturedSocket:
+    """
+    Stands in for the UDP socket of QgcConnection, keeping the sent NMEA sentences
+    Sentences to QGC are kept as destination "qgc", the ones to other destinations as "nmea/host:port".
+    """
+
+    def __init__(self, clock: SimulationClock, output: SimulationOutput, qgc_address: Tuple[str, int]):
+        self.clock = clock
+        self.output = output
+        self.qgc_address = qgc_address
+
+    def sendto(self, data, address) -> None:
+        destination = "qgc" if tuple(address) == self.qgc_address else f"nmea/{address[0]}:{address[1]}"
+        self.output.add(self.clock.time(), destination, bytes(data).decode())
+
+
+class Simulation:
+    """
+    Stand-ins of everything UgpsExtension talks to, sharing a scenario, a simulated clock and the output
+    """
+
+    def __init__(self, scenario, time_scale: float = 0.0, duration: Optional[float] = None,
+                 single_datagram: bool = False, qgc_ip: str = "simulated", nmea_udp: Sequence[str] = (),
+                 nmea_multicast: str = ""):
+        self.scenario = scenario
+        self.clock = SimulationClock(time_scale, scenario.epoch)
+        # simulated seconds to run for, the whole recording by default
+        self.duration = duration or scenario.duration or 3600.0
+        self.output = SimulationOutput()
+        self.ugps = SimulatedUgps(scenario, self.clock, self.output)
+        self.mavlink = SimulatedMavlink2Rest(scenario, self.clock, self.output)
+        # NMEA destinations as on the command line, all sentences are captured instead of sent
+        self.qgc = QgcConnection(ip=qgc_ip, single_datagram=single_datagram, destinations=nmea_udp,
+                                 multicast=nmea_multicast)
+        self.qgc.nmea_socket.close()
+        self.qgc.nmea_socket = CapturedSocket(self.clock, self.output, (qgc_ip, self.qgc.port))
+
+    @classmethod
+    def from_args(cls, args) -> "Simulation":
+        if args.simulate == "lawnmower":
+            scenario = LawnmowerScenario(dropout_rate=args.sim_dropout_rate, seed=args.sim_seed)
+        else:
+            scenario = TraceScenario(args.simulate)
+        return cls(scenario, args.sim_speed, args.sim_duration, args.nmea_single_datagram, args.qgc_ip,
+                   args.nmea_udp or (), args.nmea_multicast)
+
+    def scheduler(self) -> DeadlineScheduler:
+        if self.clock.virtual:
+            return DeadlineScheduler(clock=self.clock.monotonic, advance=self.clock.advance)
+        return DeadlineScheduler(clock=self.clock.monotonic, time_scale=self.clock.time_scale)
+
+    def report(self, real_seconds: float) -> List[str]:
+        """
+        Returns a summary of the simulation as lines of text
+        """
+        lines = [f"Simulated {self.duration:.0f} s in {real_seconds:.2f} s "
+                 f"({self.duration / max(real_seconds, 1e-9):.0f}x real time)"]
+        for destination in sorted({destination for _, destination, _ in self.output.events}):
+            count = self.output.count(destination)
+            lines.append(f"{destination}: {count} messages, {count / self.duration:.2f} Hz")
+        errors = sorted(self.output.position_errors)
+        if errors:
+            lines.append(f"GPS_INPUT position error: mean {sum(errors) / len(errors):.2f} m, "
+                         f"p95 {errors[int(0.95 * (len(errors) - 1))]:.2f} m, max {errors[-1]:.2f} m")
+        return lines
@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Tuple
+
+from loguru import logger
+
+# A route returns the content type and body of the response
+Route = Callable[[], Tuple[str, bytes]]
+
+
+class EventStream:
+    """
+    Broadcasts a state to any number of clients as server-sent events
+
+    A background thread serializes the state once per interval while clients are connected, and every client
+    is sent the same event, so the cost of producing it does not grow with the number of clients.
+    Updates between two events are coalesced into the next one. A slow client only delays itself.
+
+    Exception handling: All exceptions are caught and reported over logging, a failing client is disconnected.
+    """
+
+    def __init__(self, produce: Callable[[], object], interval: float = 1.0, keepalive: float = 15.0):
+        # produce() returns the state to send, serializable as JSON
+        self.produce = produce
+        self.interval = interval
+        # comment lines sent while there are no events, so proxies keep the connection open
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        # latest encoded event and its number
+        self.event = b""
+        self.sequence = 0
+        self.clients = 0
+        self.thread = threading.Thread(target=self._run, name="event-stream", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def serve(self, write: Callable[[bytes], None]) -> None:
+        """
+        Writes the events to one client, blocking until it disconnects
+        """
+        with self.condition:
+            self.clients += 1
+            sequence = self.sequence
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != sequence, self.keepalive)
+                    event = self.event if self.sequence != sequence else b": keepalive\n\n"
+                    sequence = self.sequence
+                write(event)
+        except (OSError, ValueError) as e:
+            logger.debug("Event stream client disconnected: {}", e)
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self.clients:
+                continue
+            try:
+                event = f"data: {json.dumps(self.produce())}\n\n".encode()
+            except Exception as e:
+                logger.error(f"Event stream failed: {e}")
+                continue
+            with self.condition:
+                self.event = event
+                self.sequence += 1
+                self.condition.notify_all()
+
+
+class StatusServer:
+    """
+    Serves the status of the extension over HTTP (e.g. /metrics) on the port exposed to BlueOS
+
+    Runs in a background thread, routes are plain functions returning content type and body.
+    Streams send server-sent events to every client until it disconnects.
+
+    Exception handling: All exceptions are caught and reported over logging, the extension keeps running without it.
+    """
+
+    def __init__(self, port: int = 80, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.routes: Dict[str, Route] = {}
+        self.streams: Dict[str, EventStream] = {}
+        self.server = None
+
+    def add_route(self, path: str, route: Route) -> None:
+        self.routes[path] = route
+
+    def add_stream(self, path: str, stream: EventStream) -> None:
+        self.streams[path] = stream
+
+    def start(self) -> None:
+        routes = self.routes
+        streams = self.streams
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stream = streams.get(self.path.split("?")[0])
+                if stream is not None:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    stream.serve(self.write_flushed)
+                    return
+                route = routes.get(self.path.split("?")[0])
+                if route is None:
+                    self.send_error(404)
+                    return
+                try:
+                    content_type, body = route()
+                except Exception as e:
+                    logger.error(f"Status page {self.path} failed: {e}")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_flushed(self, data: bytes) -> None:
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                logger.opt(lazy=True).debug("Status server: {}", lambda: format % args)
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except Exception as e:
+            logger.error(f"Could not serve status on port {self.port}: {e}")
+            return
+        # event stream clients never finish their request
+        self.server.daemon_threads = True
+        for stream in streams.values():
+            stream.start()
+        threading.Thread(target=self.server.serve_forever, name="status-server", daemon=True).start()
+        logger.info(f"Serving status on port {self.port}")
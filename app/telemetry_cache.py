@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from loguru import logger
+
+from circuit_breaker import Backoff
+from websocket_client import WebSocketClient
+
+
+class TelemetryCache:
+    """
+    Keeps the latest mavlink messages streamed over mavlink2rest's WebSocket in memory
+
+    A background thread subscribes to the given message types and stores the newest
+    message of each type together with its receive time, so that reading telemetry
+    never blocks on a request. Reconnects automatically, with an increasing delay, if the stream is lost.
+
+    Exception handling: All exceptions are caught and reported over logging, followed by a reconnect.
+    """
+
+    def __init__(self, host: str, messages: List[str], vehicle: int = 1, component: int = 1,
+                 max_reconnect_delay: float = 8.0):
+        # mavlink2rest serves its websocket on the same host and port as the REST API
+        ws_host = host.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        message_filter = quote(f"^({'|'.join(messages)})$")
+        self.url = f"{ws_host}/ws/mavlink?filter={message_filter}"
+        self.vehicle = vehicle
+        self.component = component
+        # delay between reconnects, grows while mavlink2rest is unreachable
+        self.backoff = Backoff(maximum=max_reconnect_delay)
+
+        self.lock = threading.Lock()
+        # message type -> (message, receive time)
+        self.messages: Dict[str, Tuple[dict, float]] = {}
+        # message type -> callbacks run (in the receiving thread) on every new message
+        self.listeners: Dict[str, List[Callable[[], None]]] = {}
+        self.connected = False
+        self.thread = threading.Thread(target=self._run, name="telemetry-cache", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def get(self, message_name: str) -> Optional[Tuple[dict, float]]:
+        """
+        Returns the latest message of a type and the time it was received, or None if none was received yet
+        """
+        with self.lock:
+            return self.messages.get(message_name)
+
+    def add_listener(self, message_name: str, callback: Callable[[], None]) -> None:
+        """
+        Registers "callback" to be called whenever a message of a type is received, should return quickly
+        """
+        self.listeners.setdefault(message_name, []).append(callback)
+
+    def _run(self) -> None:
+        while True:
+            client = WebSocketClient(self.url)
+            try:
+                client.connect()
+                logger.info(f"Subscribed to mavlink2rest websocket {self.url}")
+                self.connected = True
+                self.backoff.reset()
+                while True:
+                    self._handle(client.recv())
+            except Exception as e:
+                logger.error(f"Mavlink2rest websocket error: {e}")
+            finally:
+                self.connected = False
+                client.close()
+            time.sleep(self.backoff.next())
+
+    def _handle(self, text: str) -> None:
+        received = time.time()
+        try:
+            data = json.loads(text)
+            header = data["header"]
+            message = data["message"]
+            message_name = message["type"]
+        except Exception as e:
+            logger.debug("Ignoring websocket message {}: {}", text, e)
+            return
+        if header.get("system_id") != self.vehicle or header.get("component_id") != self.component:
+            return
+        with self.lock:
+            self.messages[message_name] = (message, received)
+        for callback in self.listeners.get(message_name, []):
+            callback()
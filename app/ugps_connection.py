@@ -1,20 +1,27 @@
 from typing import Any, Optional
 
-import requests
+import threading
 import time
+from datetime import datetime
 from loguru import logger
 
+from circuit_breaker import Backoff, CircuitOpenError
+from http_client import HttpClient
+
 
 class UgpsConnection:
     """
     Responsible for interfacing with UGPS G2 API
 
     Exception handling: All exceptions are caught and reported over logging. Severity "error", as they should not happen.
+    Requests skipped while the host is known to be down are only logged at "debug" level.
     """
 
-    def __init__(self, host: str = "https://demo.waterlinked.com"):
+    def __init__(self, host: str = "https://demo.waterlinked.com", client: Optional[HttpClient] = None):
         # store host
         self.host = host
+        # pooled keep-alive connections, may be shared with other API clients
+        self.client = client or HttpClient()
 
     def get(self, path: str):
         """
@@ -22,18 +29,23 @@ class UgpsConnection:
         Returns the response object or None on failure
         """
         full_url = self.host + path
-        logger.debug(f"Request url: {full_url}")
+        logger.debug("Request url: {}", full_url)
         response = None
         try:
-            response = requests.get(full_url, timeout=1)
+            response = self.client.get(full_url)
             if response.status_code == 200:
-                logger.debug(f"Got response: {response.text}")
-                if response.text == "None":
+                # decoding the body is skipped unless debug logging is enabled
+                logger.opt(lazy=True).debug("Got response: {}", lambda: response.text)
+                if response.content == b"None":
                     return None
                 return response.json()
             else:
                 logger.error(f"Got HTTP Error: {response.status_code} {response.reason} {response.text}")
                 return None
+        except CircuitOpenError as e:
+            # the outage was already reported when the circuit opened
+            logger.debug("Skipped request: {}", e)
+            return None
         except Exception as e:
             logger.error(f"Got exception: {e}")
             return None
@@ -58,47 +70,104 @@ class UgpsConnection:
         Returns if request was successful
         """
         full_url = self.host + path
-        logger.debug(f"Request url: {full_url} json: {json}")
+        logger.debug("Request url: {} json: {}", full_url, json)
         response = None
         try:
-            response = requests.put(full_url, json=json, timeout=1)
+            response = self.client.put(full_url, json=json)
             if response.status_code == 200:
-                logger.debug(f"Got response: {response.reason}")
+                logger.debug("Got response: {}", response.reason)
                 return True
             else:
                 logger.error(f"Got HTTP Error: {response.status_code} {response.reason} {response.text}")
                 return False
+        except CircuitOpenError as e:
+            # the outage was already reported when the circuit opened
+            logger.debug("Skipped request: {}", e)
+            return False
         except Exception as e:
             logger.error(f"Got exception: {e}")
             return False
 
-    def wait_for_connection(self):
+    def wait_for_connection(self, stop: Optional[threading.Event] = None) -> bool:
         """
-        Waits until the Underwater GPS system is available
-        Returns when it is found
+        Waits until the Underwater GPS system is available, retrying with an increasing delay
+        Returns True when it is found, False if "stop" was set before
         """
+        stop = stop or threading.Event()
+        backoff = Backoff()
         while True:
             logger.info("Scanning for Water Linked underwater GPS...")
             try:
-                requests.get(self.host + "/api/v1/about/", timeout=1)
-                break
+                self.client.get(self.host + "/api/v1/about/")
+                return True
             except Exception as e:
-                logger.debug(f"Got {e}")
-            time.sleep(5)
+                logger.debug("Got {}", e)
+            if stop.wait(backoff.next()):
+                return False
 
     # Specific messages
     def check_position(self, json: object) -> bool:
-        if json is None or 'lat' not in json or 'lon' not in json or 'orientation' not in json:
+        if json is None:
+            # request failed, already reported
+            return None
+        if 'lat' not in json or 'lon' not in json or 'orientation' not in json:
             logger.error(f"Position format not valid.")
             return None
         else:
             return json
 
+    def check_relative_position(self, json: object) -> bool:
+        if json is None:
+            # request failed, already reported
+            return None
+        if 'x' not in json or 'y' not in json:
+            logger.error("Relative position format not valid.")
+            return None
+        else:
+            return json
+
+    def get_position(self, path: str, check=None):
+        """
+        Requests a position and estimates when it was measured
+        Adds 'fix_time' (UNIX time) to the position: the UGPS provided timestamp if available,
+        otherwise the middle of the request, as the round trip delay is assumed to be symmetric.
+        """
+        check = check or self.check_position
+        start = time.time()
+        position = check(self.get(path))
+        end = time.time()
+        if position:
+            fix_time = self.parse_timestamp(position.get('timestamp'))
+            position['fix_time'] = fix_time if fix_time is not None else (start + end) / 2
+        return position
+
+    @staticmethod
+    def parse_timestamp(timestamp) -> Optional[float]:
+        """
+        Parses a timestamp as UNIX time, from epoch seconds or an ISO 8601 string
+        Returns None if not available or not understood
+        """
+        if isinstance(timestamp, (int, float)) and timestamp > 0:
+            return float(timestamp)
+        if isinstance(timestamp, str):
+            try:
+                return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                logger.debug("Unknown timestamp format {}", timestamp)
+        return None
+
     def get_locator_position(self):
-        return self.check_position(self.get("/api/v1/position/global"))
+        return self.get_position("/api/v1/position/global")
 
     def get_ugps_topside_position(self):
-        return self.check_position(self.get("/api/v1/position/master"))
+        return self.get_position("/api/v1/position/master")
+
+    def get_relative_position(self, path: str = "/api/v1/position/acoustic/filtered"):
+        """
+        Requests the acoustic position of a locator relative to the topside, 'x' and 'y' in meters,
+        with 'fix_time' as for get_position()
+        """
+        return self.get_position(path, self.check_relative_position)
 
     def send_locator_depth_temperature(self, depth: float, temperature: float):
         json = {}
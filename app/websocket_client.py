@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import os
+import socket
+import ssl
+import struct
+from typing import Optional
+from urllib.parse import urlsplit
+
+# Opcodes as defined in RFC 6455
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class WebSocketClient:
+    """
+    Minimal WebSocket client (RFC 6455) for receiving text messages, e.g. from mavlink2rest
+
+    Only what is needed to subscribe to a message stream is implemented: handshake,
+    (fragmented) text frames, ping/pong and close. Supports ws:// and wss:// urls.
+
+    Exception handling: Exceptions are passed on to the caller, which is expected to reconnect.
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        # a stream is considered dead if nothing was received for this long
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self) -> None:
+        """
+        Opens the connection and performs the opening handshake
+        """
+        url = urlsplit(self.url)
+        secure = url.scheme == "wss"
+        port = url.port or (443 if secure else 80)
+        resource = (url.path or "/") + (f"?{url.query}" if url.query else "")
+
+        sock = socket.create_connection((url.hostname, port), timeout=self.timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=url.hostname)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (f"GET {resource} HTTP/1.1\r\n"
+                   f"Host: {url.hostname}:{port}\r\n"
+                   "Upgrade: websocket\r\n"
+                   "Connection: Upgrade\r\n"
+                   f"Sec-WebSocket-Key: {key}\r\n"
+                   "Sec-WebSocket-Version: 13\r\n"
+                   "\r\n")
+        sock.sendall(request.encode())
+
+        reader = sock.makefile("rb")
+        status = reader.readline().decode(errors="replace")
+        if " 101 " not in status:
+            sock.close()
+            raise ConnectionError(f"WebSocket handshake failed: {status.strip()}")
+        headers = {}
+        while True:
+            line = reader.readline().decode(errors="replace").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        expected = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        if headers.get("sec-websocket-accept") != expected:
+            sock.close()
+            raise ConnectionError("WebSocket handshake failed: invalid Sec-WebSocket-Accept")
+
+        self.sock = sock
+        self.reader = reader
+
+    def recv(self) -> str:
+        """
+        Blocks until a complete text message is received
+        Returns the message, raises ConnectionError if the server closed the connection
+        """
+        fragments = []
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OPCODE_PING:
+                self._send_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_PONG:
+                continue
+            elif opcode == OPCODE_CLOSE:
+                self.close()
+                raise ConnectionError("WebSocket closed by server")
+            else:
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode("utf-8", errors="replace")
+
+    def close(self) -> None:
+        if self.sock is None:
+            return
+        try:
+            self._send_frame(OPCODE_CLOSE, b"")
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self.reader.read(size)
+        if data is None or len(data) < size:
+            raise ConnectionError("WebSocket connection lost")
+        return data
+
+    def _read_frame(self):
+        first, second = self._read_exactly(2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", self._read_exactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", self._read_exactly(8))
+        mask: Optional[bytes] = self._read_exactly(4) if second & 0x80 else None
+        payload = self._read_exactly(length) if length else b""
+        if mask:
+            payload = self._apply_mask(payload, mask)
+        return fin, opcode, payload
+
+    def _send_frame(self, opcode: int, payload: bytes) -> None:
+        # frames sent by a client are always masked
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+        mask = os.urandom(4)
+        self.sock.sendall(header + mask + self._apply_mask(payload, mask))
+
+    @staticmethod
+    def _apply_mask(payload: bytes, mask: bytes) -> bytes:
+        # xor the whole payload at once as an integer, instead of byte by byte
+        repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+        masked = int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+        return masked.to_bytes(len(payload), "big")
@@ -0,0 +1,269 @@
+"""
+Local stand-ins for the UGPS topside API and mavlink2rest, for benchmarking the extension
+
+Both servers implement the endpoints used by UgpsConnection and Mavlink2RestBase, with injectable
+latency, jitter and failure rate. The UGPS produces new locator fixes at a fixed rate and the fake
+mavlink2rest records when each fix arrives as GPS_INPUT, which gives the end-to-end latency.
+"""
+
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from simulation import TEMPLATES  # noqa: E402
+
+BASE_LAT = 63.422065
+BASE_LON = 10.434353
+# latitude step between consecutive fixes, about 0.1 m
+FIX_STEP = 1e-6
+
+
+class FaultConfig:
+    """
+    Latency, jitter (both in seconds) and failure rate (0-1) injected into every request
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, avoid Nagle delaying the body until the headers are acked
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, status: int = 200) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def inject_faults(self) -> bool:
+        """
+        Delays the request and decides whether it fails
+        Returns True if the request failed and was already answered
+        """
+        faults = self.server.faults
+        delay = faults.latency + random.uniform(-faults.jitter, faults.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < faults.failure_rate:
+            self.reply({"error": "injected failure"}, status=503)
+            return True
+        return False
+
+
+class FakeUgpsHandler(FakeHandler):
+    def do_GET(self):
+        if self.inject_faults():
+            return
+        path = urlsplit(self.path).path
+        state = self.server.state
+        if path == "/api/v1/about/":
+            self.reply({"product_name": "fake ugps", "version": "benchmark"})
+        elif path == "/api/v1/position/global":
+            self.reply(state.locator_position())
+        elif path == "/api/v1/position/master":
+            self.reply(state.topside_position())
+        else:
+            self.reply({"error": "not found"}, status=404)
+
+    def do_PUT(self):
+        # the body is not used, but has to be read off the keep-alive connection
+        self.read_json()
+        if self.inject_faults():
+            return
+        path = urlsplit(self.path).path
+        if path in ("/api/v1/external/depth", "/api/v1/external/orientation"):
+            self.server.state.count(path)
+            self.reply({})
+        else:
+            self.reply({"error": "not found"}, status=404)
+
+
+class FakeMavlink2RestHandler(FakeHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        state = self.server.state
+        if url.path == "/_benchmark/stats":
+            self.reply(state.stats())
+            return
+        if self.inject_faults():
+            return
+        if url.path == "/helper/mavlink":
+            name = parse_qs(url.query).get("name", [""])[0]
+            self.reply(state.template(name))
+            return
+        prefix = "/mavlink/vehicles/1/components/1/messages/"
+        if not url.path.startswith(prefix):
+            self.reply({"error": "not found"}, status=404)
+            return
+        value = state.message_path(url.path[len(prefix):].split("/"))
+        if value is None:
+            self.reply({"error": "not found"}, status=404)
+        else:
+            self.reply(value)
+
+    def do_POST(self):
+        body = self.read_json()
+        if self.inject_faults():
+            return
+        if urlsplit(self.path).path != "/mavlink":
+            self.reply({"error": "not found"}, status=404)
+            return
+        self.server.state.receive(body)
+        self.reply("Ok")
+
+
+class FakeState:
+    """
+    Shared state of the fake UGPS and mavlink2rest: vehicle telemetry, locator fixes and received messages
+    """
+
+    def __init__(self, fix_rate: float = 4.0):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.fix_rate = fix_rate
+        # fix number -> time the fix was produced
+        self.fix_times = {}
+        # (receive time, end-to-end latency) of the first GPS_INPUT of every fix
+        self.gps_inputs = []
+        self.delivered = set()
+        self.counters = {}
+        self.intervals = {"VFR_HUD": 0.2, "SCALED_PRESSURE2": 1.0}
+        self.params = {}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def current_fix(self) -> int:
+        fix = int((time.time() - self.start) * self.fix_rate)
+        with self.lock:
+            self.fix_times.setdefault(fix, self.start + fix / self.fix_rate)
+        return fix
+
+    def locator_position(self) -> dict:
+        fix = self.current_fix()
+        return {"lat": BASE_LAT + fix * FIX_STEP, "lon": BASE_LON, "orientation": 45.0, "cog": 10.0, "sog": 1.8,
+                "fix_quality": 1, "hdop": 1.2, "numsats": 0}
+
+    def topside_position(self) -> dict:
+        return {"lat": BASE_LAT, "lon": BASE_LON, "orientation": 90.0, "cog": 0.0, "sog": 0.0,
+                "fix_quality": 1, "hdop": 0.8, "numsats": 9}
+
+    def messages(self) -> dict:
+        elapsed = time.time() - self.start
+        return {
+            "VFR_HUD": {"type": "VFR_HUD", "alt": -5.0 - math.sin(elapsed / 10), "heading": int(elapsed * 10) % 360,
+                        "airspeed": 0.0, "groundspeed": 0.0, "throttle": 0, "climb": 0.0},
+            "SCALED_PRESSURE2": {"type": "SCALED_PRESSURE2", "temperature": 1250 + int(elapsed) % 50,
+                                 "press_abs": 1500.0, "press_diff": 0.0, "time_boot_ms": int(elapsed * 1000)},
+            "PARAM_VALUE": self.params.get("_last", {"type": "PARAM_VALUE"}),
+        }
+
+    def message_path(self, parts):
+        messages = self.messages()
+        name = parts[0]
+        if name not in messages:
+            return None
+        interval = self.intervals.get(name, 1.0)
+        now = datetime.now().astimezone()
+        value = {
+            "message": messages[name],
+            "message_information": {
+                "counter": int((time.time() - self.start) / interval),
+                "frequency": 1.0 / interval,
+                "time": {"first_message": now.isoformat(), "last_message": now.isoformat()},
+            },
+        }
+        for part in parts[1:]:
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+    def template(self, name: str) -> dict:
+        message = dict(TEMPLATES.get(name, {}), type=name)
+        return {"header": {"system_id": 255, "component_id": 0, "sequence": 0}, "message": message}
+
+    def receive(self, body: dict) -> None:
+        received = time.time()
+        message = body.get("message", {})
+        message_type = message.get("type")
+        self.count(message_type)
+        if message_type == "GPS_INPUT":
+            fix = round((message["lat"] / 1e7 - BASE_LAT) / FIX_STEP)
+            with self.lock:
+                produced = self.fix_times.get(fix)
+                if produced is not None and fix not in self.delivered:
+                    self.delivered.add(fix)
+                    self.gps_inputs.append((received, received - produced))
+        elif message_type == "COMMAND_LONG" and message["command"]["type"] == "MAV_CMD_SET_MESSAGE_INTERVAL":
+            names = {74: "VFR_HUD", 137: "SCALED_PRESSURE2"}
+            name = names.get(int(message["param1"]))
+            if name is not None and message["param2"] > 0:
+                self.intervals[name] = message["param2"] / 1e6
+        elif message_type in ("PARAM_SET", "PARAM_REQUEST_READ"):
+            param_id = "".join(message["param_id"]).rstrip("\u0000")
+            if message_type == "PARAM_SET":
+                self.params[param_id] = message["param_value"]
+            self.params["_last"] = {"type": "PARAM_VALUE", "param_id": list(param_id.ljust(16, "\u0000")),
+                                    "param_value": self.params.get(param_id, 0.0),
+                                    "param_type": {"type": "MAV_PARAM_TYPE_UINT8"}}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"gps_inputs": list(self.gps_inputs), "counters": dict(self.counters)}
+
+
+def start_servers(faults: FaultConfig, fix_rate: float = 4.0, host: str = "127.0.0.1"):
+    """
+    Starts the fake UGPS and mavlink2rest on free ports, in background threads
+    Returns (ugps server, mavlink2rest server)
+    """
+    state = FakeState(fix_rate)
+    servers = []
+    for handler in (FakeUgpsHandler, FakeMavlink2RestHandler):
+        server = ThreadingHTTPServer((host, 0), handler)
+        server.daemon_threads = True
+        server.faults = faults
+        server.state = state
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return tuple(servers)
+
+
+def serve_in_process(latency: float, jitter: float, failure_rate: float, fix_rate: float, ports) -> None:
+    """
+    Entry point for running the servers in a separate process, so they do not count towards the
+    CPU time of the extension. The chosen ports are put into the "ports" queue.
+    """
+    ugps, mavlink = start_servers(FaultConfig(latency, jitter, failure_rate), fix_rate)
+    ports.put((ugps.server_address[1], mavlink.server_address[1]))
+    while True:
+        time.sleep(3600)
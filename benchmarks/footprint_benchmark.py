@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the runtime footprint of the extension: import time, memory (RSS), CPU and log volume
+
+Compares the default runtime (requests backend, debug logging, every forwarding cycle logged) with the lean one
+(--http_backend stdlib --log_level INFO --log_sample_interval 60) the container runs with. Each runs as its own
+process against the fake UGPS and mavlink2rest of the forwarding benchmark, which run in another process so they
+are not measured.
+Needs Linux, memory and CPU time are read from /proc.
+Usage: python benchmarks/footprint_benchmark.py [seconds]
+"""
+
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_servers
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+PROFILES = {
+    "default": ["--http_backend", "requests"],
+    "lean": ["--http_backend", "stdlib", "--log_level", "INFO", "--log_sample_interval", "60"],
+}
+# imports the extension and creates its HTTP client, as done on startup
+IMPORT = """
+import sys, time
+start = time.perf_counter()
+import main
+from http_client import HttpClient
+HttpClient(backend=sys.argv[1])
+print(time.perf_counter() - start, "requests" in sys.modules)
+"""
+
+
+def import_time(backend: str, repeats: int = 5):
+    """
+    Returns the median seconds to import the extension with a backend, and if requests got imported
+    """
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT, backend], cwd=APP, capture_output=True, text=True,
+                                check=True).stdout.split()
+        results.append((float(output[0]), output[1] == "True"))
+    return statistics.median(seconds for seconds, _ in results), results[0][1]
+
+
+def proc_status(pid: int) -> dict:
+    """
+    Returns VmRSS and VmHWM (peak RSS) of a process in kB
+    """
+    with open(f"/proc/{pid}/status") as status:
+        fields = dict(line.split(":", 1) for line in status)
+    return {key: int(fields[key].split()[0]) for key in ("VmRSS", "VmHWM")}
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        # fields after the command name, utime and stime are fields 14 and 15
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run(profile: str, ugps_port: int, mavlink_port: int, seconds: float) -> dict:
+    """
+    Runs the extension for "seconds", returns its memory, CPU time and log lines
+    """
+    with tempfile.TemporaryFile("w+") as log:
+        process = subprocess.Popen(
+            [sys.executable, "main.py", "--ugps_host", f"http://127.0.0.1:{ugps_port}",
+             "--mavlink_host", f"http://127.0.0.1:{mavlink_port}", "--qgc_ip", "127.0.0.1", "--http_port", "0"]
+            + PROFILES[profile], cwd=APP, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            time.sleep(seconds)
+            result = dict(proc_status(process.pid), cpu=cpu_seconds(process.pid))
+        finally:
+            process.terminate()
+            process.wait()
+        log.seek(0)
+        lines = log.readlines()
+    result["log_lines"] = len(lines)
+    result["first_fix"] = next((line.split("sent ")[1].split(" s")[0] for line in lines
+                                if "First GPS_INPUT sent" in line), "-")
+    return result
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    ports = multiprocessing.Queue()
+    servers = multiprocessing.Process(target=fake_servers.serve_in_process, daemon=True,
+                                      args=(0.0, 0.0, 0.0, 4.0, ports))
+    servers.start()
+    ugps_port, mavlink_port = ports.get(timeout=10)
+
+    print(f"{'profile':8} {'import':>9} {'requests':>9} {'RSS':>9} {'peak RSS':>9} {'CPU':>8} {'log lines':>10} "
+          f"{'first fix':>10}")
+    for profile, arguments in PROFILES.items():
+        seconds_to_import, imports_requests = import_time(arguments[1])
+        result = run(profile, ugps_port, mavlink_port, seconds)
+        print(f"{profile:8} {seconds_to_import * 1000:7.0f}ms {str(imports_requests):>9} "
+              f"{result['VmRSS'] / 1024:7.1f}MB {result['VmHWM'] / 1024:7.1f}MB {result['cpu']:7.2f}s "
+              f"{result['log_lines']:10d} {result['first_fix']:>9}s")
+    print(f"CPU time and log lines over {seconds:.0f} s of forwarding")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of UgpsExtension against local fake UGPS and mavlink2rest servers
+
+Reports the achieved forwarding rates, the end-to-end latency from a locator fix being produced by
+the (fake) UGPS until it arrives at (fake) mavlink2rest as GPS_INPUT, and the CPU time of the extension
+per job run. Arguments after "--" are passed on to the extension, e.g.:
+
+    python benchmarks/forwarding_benchmark.py --duration 30 --latency 0.02 --jitter 0.01 -- --locator_rate 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from loguru import logger  # noqa: E402
+
+import fake_servers  # noqa: E402
+from main import UgpsExtension, build_parser  # noqa: E402
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def fetch_stats(mavlink_host):
+    with urllib.request.urlopen(mavlink_host + "/_benchmark/stats") as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=20.0, help="Measured duration in seconds.")
+    parser.add_argument('--warmup', type=float, default=5.0, help="Seconds to run before measuring.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Injected latency per request in seconds.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Injected latency jitter (+-) in seconds.")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="Fraction of requests that fail (0-1).")
+    parser.add_argument('--fix_rate', type=float, default=4.0, help="Rate in Hz of new locator fixes of the UGPS.")
+    parser.add_argument('--log_level', type=str, default="WARNING", help="Log level of the extension.")
+    argv = sys.argv[1:]
+    extension_argv = []
+    if "--" in argv:
+        extension_argv = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    options = parser.parse_args(argv)
+
+    # servers run in their own process, so they are not counted as CPU time of the extension
+    ports = multiprocessing.Queue()
+    servers = multiprocessing.Process(target=fake_servers.serve_in_process, daemon=True,
+                                      args=(options.latency, options.jitter, options.failure_rate,
+                                            options.fix_rate, ports))
+    servers.start()
+    ugps_port, mavlink_port = ports.get(timeout=10)
+    ugps_host = f"http://127.0.0.1:{ugps_port}"
+    mavlink_host = f"http://127.0.0.1:{mavlink_port}"
+
+    logger.remove()
+    logger.add(sys.stderr, level=options.log_level)
+    args = build_parser().parse_args(["--ugps_host", ugps_host, "--mavlink_host", mavlink_host,
+                                      "--qgc_ip", "127.0.0.1", "--http_port", "0"] + extension_argv)
+    extension = UgpsExtension(args)
+    thread = threading.Thread(target=extension.run, daemon=True)
+    thread.start()
+
+    time.sleep(options.warmup)
+    before = fetch_stats(mavlink_host)
+    runs_before = sum(stats["runs"] for stats in extension.scheduler.stats().values())
+    cpu_before = time.process_time()
+    start = time.time()
+    time.sleep(options.duration)
+    cpu = time.process_time() - cpu_before
+    elapsed = time.time() - start
+    runs = sum(stats["runs"] for stats in extension.scheduler.stats().values()) - runs_before
+    after = fetch_stats(mavlink_host)
+    # no jobs may be left running when the interpreter shuts down
+    extension.scheduler.stop()
+    thread.join()
+
+    latencies = [latency for received, latency in after["gps_inputs"] if received >= start]
+    counters = {name: after["counters"].get(name, 0) - before["counters"].get(name, 0)
+                for name in after["counters"]}
+
+    print(f"Measured {elapsed:.1f} s, injected latency {options.latency * 1000:.0f} ms "
+          f"+- {options.jitter * 1000:.0f} ms, failure rate {options.failure_rate:.0%}")
+    print(f"New fixes forwarded:  {len(latencies) / elapsed:6.2f} Hz (UGPS produces {options.fix_rate:.2f} Hz)")
+    print(f"GPS_INPUT messages:   {counters.get('GPS_INPUT', 0) / elapsed:6.2f} Hz")
+    print(f"Depth updates:        {counters.get('/api/v1/external/depth', 0) / elapsed:6.2f} Hz")
+    print(f"Orientation updates:  {counters.get('/api/v1/external/orientation', 0) / elapsed:6.2f} Hz")
+    print("Fix to GPS_INPUT latency: " + ", ".join(
+        f"p{int(fraction * 100)} {percentile(latencies, fraction) * 1000:.1f} ms" for fraction in (0.5, 0.9, 0.99)))
+    print(f"CPU: {cpu / elapsed:.1%} of a core, {cpu / max(runs, 1) * 1e6:.0f} us per job run ({runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark of sending GPS_INPUT over mavlink2rest (JSON over HTTP) against binary MAVLink v2 over UDP
+
+Sends the same locator position with Mavlink2RestHelper.send_gps_input through both backends, to the fake
+mavlink2rest of the forwarding benchmark and to a UDP receiver, both in a separate process so only the
+sending side is measured. The receiver checks length and checksum of every frame.
+Usage: python benchmarks/gps_input_benchmark.py [messages]
+"""
+
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from loguru import logger  # noqa: E402
+
+import fake_servers  # noqa: E402
+from mavlink2resthelper import Mavlink2RestHelper  # noqa: E402
+from mavlink_udp import GPS_INPUT, HEADER_SIZE, MavlinkUdpConnection, x25_crc  # noqa: E402
+
+POSITION = {"lat": 63.422065, "lon": 10.4343532, "orientation": 123.4, "fix_quality": 1, "hdop": 1.2,
+            "numsats": 0, "fix_time": time.time(), "vn": 0.3, "ve": -0.1, "horiz_accuracy": 0.8}
+
+
+def receive_frames(ports, results, expected: int) -> None:
+    """
+    Receives GPS_INPUT frames until "expected" arrived or the sender stops, puts (received, valid) into results
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    ports.put(receiver.getsockname()[1])
+    received = valid = 0
+    try:
+        while received < expected:
+            frame = receiver.recv(512)
+            # the sender may stop early, e.g. on errors
+            receiver.settimeout(2.0)
+            received += 1
+            length = frame[1]
+            message_id = int.from_bytes(frame[7:10], "little")
+            crc = x25_crc((GPS_INPUT.crc_extra,), x25_crc(frame[1:HEADER_SIZE + length]))
+            if (len(frame) == HEADER_SIZE + length + 2 and message_id == GPS_INPUT.id
+                    and crc == int.from_bytes(frame[-2:], "little")):
+                valid += 1
+    except socket.timeout:
+        pass
+    results.put((received, valid))
+
+
+def measure(helper: Mavlink2RestHelper, messages: int):
+    """
+    Returns (wall, CPU) seconds per message
+    """
+    helper.send_gps_input(POSITION)  # templates, connections
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(messages):
+        helper.send_gps_input(POSITION)
+    return (time.perf_counter() - wall) / messages, (time.process_time() - cpu) / messages
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    ports = multiprocessing.Queue()
+    servers = multiprocessing.Process(target=fake_servers.serve_in_process, daemon=True,
+                                      args=(0.0, 0.0, 0.0, 4.0, ports))
+    servers.start()
+    _, mavlink_port = ports.get(timeout=10)
+    rest = Mavlink2RestHelper(host=f"http://127.0.0.1:{mavlink_port}")
+
+    results = multiprocessing.Queue()
+    receiver = multiprocessing.Process(target=receive_frames, daemon=True, args=(ports, results, messages + 1))
+    receiver.start()
+    udp = Mavlink2RestHelper(host="unused", udp=MavlinkUdpConnection(f"127.0.0.1:{ports.get(timeout=10)}"))
+
+    rest_wall, rest_cpu = measure(rest, messages)
+    udp_wall, udp_cpu = measure(udp, messages)
+    received, valid = results.get(timeout=10)
+
+    print(f"{messages} GPS_INPUT messages per backend")
+    print(f"mavlink2rest (HTTP/JSON): {rest_wall * 1e6:8.1f} us wall, {rest_cpu * 1e6:8.1f} us CPU per message")
+    print(f"MAVLink v2 over UDP:      {udp_wall * 1e6:8.1f} us wall, {udp_cpu * 1e6:8.1f} us CPU per message")
+    print(f"Speedup: {rest_wall / udp_wall:.1f}x wall, {rest_cpu / udp_cpu:.1f}x CPU")
+    print(f"UDP frames received: {received}, valid: {valid}")
+
+
+if __name__ == "__main__":
+    main()
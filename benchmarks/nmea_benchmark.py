@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of encoding a topside position as NMEA sentences
+
+Compares NmeaEncoder against the previous str.format based encoding of QgcConnection,
+which is kept here as reference. Usage: python benchmarks/nmea_benchmark.py [iterations]
+"""
+
+import operator
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+from functools import reduce
+from math import floor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from nmea import NmeaEncoder  # noqa: E402
+
+POSITION = {"lat": 63.422065, "lon": 10.4343532, "orientation": 123.4, "fix_quality": 1, "hdop": 1.2,
+            "numsats": 7, "sog": 1.5, "cog": 45.0}
+
+GPGGA = ("$GPGGA,{hours:02d}{minutes:02d}{seconds:02.2f},{lat:02.0f}{latmin:02.3f},{latdir},"
+         "{lon:03.0f}{lonmin:02.3f},{londir},{fix},{satellites:02d},{hdop:01.2f},0,M,0,M,00,0000*")
+GPRMC = ("$GPRMC,{hours:02d}{minutes:02d}{seconds:02.2f},A,{lat:02.0f}{latmin:02.3f},{latdir},"
+         "{lon:03.0f}{lonmin:02.3f},{londir},{knots:01.1f},{orientation:03.2f},{date},,,A*")
+GPVTG = "$GPVTG,{cog:03.1f},T,,M,{knots:02.1f},N,{kph:02.1f},K,A*"
+
+
+def legacy_format_nmea(message, now, in_json):
+    """
+    Previous QgcConnection.format_nmea
+    """
+    lat = float(in_json['lat'])
+    lon = float(in_json['lon'])
+    latdir = "N" if lat > 0 else "S"
+    londir = "E" if lon > 0 else "W"
+    lat = abs(lat)
+    lon = abs(lon)
+    msg = message.format(date=now.strftime("%d%m%y"), hours=now.hour, minutes=now.minute,
+                         seconds=(now.second + now.microsecond/1000000.0),
+                         fix=0 if in_json['fix_quality'] == 0 else 3, satellites=max(in_json['numsats'], 0),
+                         hdop=(9.9 if in_json['hdop'] == -1 else in_json['hdop']),
+                         lat=floor(lat), latmin=(lat % 1) * 60, latdir=latdir,
+                         lon=floor(lon), lonmin=(lon % 1) * 60, londir=londir,
+                         orientation=in_json['orientation'], knots=in_json['sog']/1.852, kph=in_json['sog'],
+                         cog=in_json['cog'])
+    data, _ = msg.split("*")
+    checksum = reduce(operator.xor, bytearray(data[1:], "utf-8"), 0)
+    return f"{msg}{checksum:02x}\r\n"
+
+
+def legacy_burst():
+    return [legacy_format_nmea(message, datetime.now(timezone.utc), POSITION).encode('utf-8')
+            for message in (GPGGA, GPRMC, GPVTG)]
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    encoder = NmeaEncoder()
+
+    def encoder_burst():
+        encoder.encode(POSITION, datetime.now(timezone.utc))
+        return encoder.sentences()
+
+    print("".join(sentence.decode() for sentence in legacy_burst()), end="")
+    print(encoder.encode(POSITION, datetime.now(timezone.utc)).decode(), end="")
+
+    results = {}
+    for name, function in (("format_nmea", legacy_burst), ("NmeaEncoder", encoder_burst)):
+        seconds = min(timeit.repeat(function, number=iterations, repeat=5))
+        results[name] = seconds / iterations * 1e6
+        print(f"{name:>12}: {results[name]:.2f} us per burst of 3 sentences")
+    print(f"{'speedup':>12}: {results['format_nmea'] / results['NmeaEncoder']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Regression check: hosts that time out, connecting or reading, open the circuit breaker with every HTTP backend
+
+A listener with a full accept queue drops new connection attempts, as a switched off host on the network does,
+so connecting times out. A listener that accepts but never answers makes reading time out.
+Exits with an error if a timeout is not reported as such, or the circuit does not open.
+Usage: python benchmarks/timeout_check.py
+"""
+
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from loguru import logger  # noqa: E402
+
+from circuit_breaker import OPEN, CircuitOpenError  # noqa: E402
+from http_client import BACKENDS, HttpClient  # noqa: E402
+from metrics import HTTP_ERRORS  # noqa: E402
+
+FAILURE_THRESHOLD = 3
+
+
+def silent_listener(backlog_full: bool):
+    """
+    Returns a listening socket that never answers, with a full accept queue if "backlog_full",
+    and the connections filling it
+    """
+    listener = socket.create_server(("127.0.0.1", 0), backlog=0)
+    clients = []
+    if backlog_full:
+        # the connections keep the accept queue full, further connection attempts are dropped
+        for _ in range(2):
+            client = socket.socket()
+            client.setblocking(False)
+            client.connect_ex(listener.getsockname())
+            clients.append(client)
+        time.sleep(0.1)
+    return listener, clients
+
+
+def timeout_errors(host: str) -> float:
+    return HTTP_ERRORS.values.get((host, "GET", "/", "timeout"), 0.0)
+
+
+def check(backend: str, backlog_full: bool) -> bool:
+    listener, clients = silent_listener(backlog_full)
+    host = f"127.0.0.1:{listener.getsockname()[1]}"
+    client = HttpClient(timeout=0.3, failure_threshold=FAILURE_THRESHOLD, backend=backend)
+    for _ in range(FAILURE_THRESHOLD + 1):
+        try:
+            client.get(f"http://{host}/")
+        except CircuitOpenError:
+            break
+        except Exception as e:
+            logger.debug("Got {}", e)
+    state = client.breaker(host).state
+    timeouts = timeout_errors(host)
+    ok = state == OPEN and timeouts == FAILURE_THRESHOLD
+    print(f"{backend:8} {'connect' if backlog_full else 'read':8} timeouts counted: {timeouts:.0f}, "
+          f"circuit: {state} {'ok' if ok else 'FAILED'}")
+    for sock in [listener] + clients:
+        sock.close()
+    return ok
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    results = [check(backend, backlog_full) for backend in BACKENDS for backlog_full in (True, False)]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()